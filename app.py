@@ -1,22 +1,33 @@
+import time
+started = time.perf_counter()
+
 import streamlit as st
 import streamlit_authenticator as stauth
 from streamlit_option_menu import option_menu
 from pathlib import Path
+import os
 
 import database as db
+import metrics
+import page_loader
+import profiling
 
-
-# pages
-from inventory_page import inventory
-from income_page import income
-from expense_page import expense
-from statistics_page import statistics
+page_loader.record("app", time.perf_counter() - started) # only the first run of a worker is kept
 
 # features we want:
 # - change ALL fetch_all functions to async (need?)
 
 PAGE_TITLE = "鎧碇有限公司 - 會計程式"
 TAB_OPTIONS = ["存貨", "收入", "支出", "統計"]
+ADMIN_USERS = [user.strip() for user in os.getenv("ADMIN_USERS", "").split(",") if user.strip()] # usernames, read from .env
+
+# pages, imported when their tab is first selected (see page_loader.load_page)
+PAGES = {
+    TAB_OPTIONS[0]: ("inventory_page", "inventory"),
+    TAB_OPTIONS[1]: ("income_page", "income"),
+    TAB_OPTIONS[2]: ("expense_page", "expense"),
+    TAB_OPTIONS[3]: ("statistics_page", "statistics"),
+}
     
 # --- PATH SETTINGS ---
 THIS_DIR = Path(__file__).parent if "__file__" in locals() else Path.cwd()
@@ -24,9 +35,13 @@ ASSETS_DIR = THIS_DIR / "assets"
 STYLES_DIR = THIS_DIR / "styles"
 CSS_FILE = STYLES_DIR / "main.css"
 
-def load_css_file(css_file_path):
+@st.cache_data
+def read_css_file(css_file_path):
     with open(css_file_path) as f:
-        return st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+        return f.read()
+
+def load_css_file(css_file_path):
+    return st.markdown(f"<style>{read_css_file(css_file_path)}</style>", unsafe_allow_html=True)
 
 # --- PAGE CONFIG ---
 st.set_page_config(
@@ -53,14 +68,25 @@ def streamlit_menu():
 selected = streamlit_menu()
 
 # --- USER AUTHENTICATION ---
-users = db.fetch_all_users()
-
-usernames = [user["key"] for user in users]
-names = [user["name"] for user in users]
-hashed_passwords = [user["password"] for user in users]
-
-authenticator = stauth.Authenticate(names, usernames, hashed_passwords,
-    "sales_dashboard", "abcdef", cookie_expiry_days=30)
+def get_authenticator():
+    """Returns this session's Authenticate, built again only when the user list has changed
+    or nobody is logged in (a successful login() replaces its exp_date method with a number,
+    so one object cannot log in twice, e.g. after a logout)"""
+    users_version, users = db.users_snapshot() # cached, see db.USERS_TTL_SECONDS
+    stored = st.session_state.get("authenticator")
+    if stored is not None and stored[0] == users_version and st.session_state.get("authentication_status"):
+        return stored[1]
+
+    usernames = [user["key"] for user in users]
+    names = [user["name"] for user in users]
+    hashed_passwords = [user["password"] for user in users]
+
+    authenticator = stauth.Authenticate(names, usernames, hashed_passwords,
+        "sales_dashboard", "abcdef", cookie_expiry_days=30)
+    st.session_state["authenticator"] = (users_version, authenticator)
+    return authenticator
+
+authenticator = get_authenticator()
 
 name, authentication_status, username = authenticator.login("請先登入：", "sidebar")
 
@@ -73,12 +99,48 @@ if authentication_status == None:
 if authentication_status:
     st.sidebar.title(f"歡迎您，{name}！")
     authenticator.logout("登出", "sidebar")
-
-    if selected == TAB_OPTIONS[0]:
-        inventory()
-    if selected == TAB_OPTIONS[1]:
-        income()
-    if selected == TAB_OPTIONS[2]:
-        expense()
-    if selected == TAB_OPTIONS[3]:
-        statistics()
+    is_admin = username in ADMIN_USERS
+
+    # Profiling (admins only): step timings of this rerun, and on request a cProfile dump of it
+    if is_admin and st.session_state.get("profiling_enabled"):
+        profiling.start_run()
+    cprofile_requested = is_admin and st.session_state.pop("cprofile_next_run", False)
+    profiler = profiling.start_cprofile() if cprofile_requested else None # None while another session is being profiled
+
+    module_name, function_name = PAGES[selected]
+    try:
+        with profiling.span(f"import {module_name}"):
+            page = page_loader.load_page(module_name, function_name)
+        with profiling.span(module_name):
+            page()
+    finally: # also when the page stops early, e.g. for st.experimental_rerun
+        if profiler is not None:
+            st.session_state["cprofile_report"] = profiling.save_cprofile(profiler, module_name)
+        run = profiling.finish_run()
+
+    if is_admin:
+        with st.sidebar.expander("載入時間"):
+            st.caption("\n\n".join(page_loader.import_report()))
+
+        with st.sidebar.expander("數據庫用時"):
+            st.dataframe(metrics.summary(), hide_index=True, use_container_width=True)
+            st.download_button("下載Prometheus格式", metrics.prometheus_text(), file_name="metrics.prom", mime="text/plain")
+            if st.button("寫入指標文件"):
+                st.caption(f"已寫入 {metrics.write_prometheus()}")
+
+        with st.sidebar.expander("載入步驟"):
+            st.checkbox("記錄每次載入的步驟用時", key="profiling_enabled")
+            if run is not None:
+                spans, total = run
+                st.code("\n".join(profiling.waterfall_lines(spans, total)), language=None)
+            # on_click runs before the rerun the click starts, so that rerun is the one profiled
+            st.button("以cProfile記錄一次載入", on_click=lambda: st.session_state.update(cprofile_next_run=True))
+            if cprofile_requested and profiler is None:
+                st.warning("另一個cProfile記錄正在進行，請稍後再試。")
+            report = st.session_state.get("cprofile_report")
+            if report is not None:
+                path, text = report
+                st.caption(f"已儲存 {path}")
+                st.code(text, language=None)
+                with open(path, "rb") as f:
+                    st.download_button("下載 .prof 文件", f.read(), file_name=os.path.basename(path))
@@ -0,0 +1,327 @@
+import json
+import os
+import secrets
+import sqlite3
+import threading
+from pathlib import Path
+from urllib.parse import quote
+
+import urllib3  # pip install urllib3
+
+# Storage backends for database.py.
+# Every backend hands out "tables" that behave like a deta.Base, so the helpers in
+# database.py work the same whatever engine sits behind them:
+#   put(data, key=None) / put_many(items) / get(key) / update(updates, key) / delete(key)
+#   fetch(query=None, limit=1000, last=None) -> FetchResponse(count, last, items)
+# The SQLite engine understands the common Deta query operators (?gt, ?gte, ?lt, ?lte, ?ne, ?r, ?pfx, ?contains).
+#
+# Choose the engine with STORAGE_BACKEND in .env:
+#   STORAGE_BACKEND=deta    (default) remote Deta Base, needs DETA_KEY (DETA_BASE_URL, DETA_POOL_SIZE, DETA_CONNECT_TIMEOUT, DETA_READ_TIMEOUT optional)
+#   STORAGE_BACKEND=sqlite  local SQLite file at SQLITE_PATH (default ./data/ledger.db)
+
+DEFAULT_SQLITE_PATH = "./data/ledger.db"
+
+
+class FetchResponse:
+    """Same shape as deta's FetchResponse: one page of items plus the key to continue from"""
+
+    def __init__(self, count=0, last=None, items=None):
+        self.count = count
+        self.last = last
+        self.items = items if items is not None else []
+
+
+def new_key():
+    """A random key in the style of the ones Deta makes up"""
+    return secrets.token_hex(6)
+
+
+# ---- 1. Deta ----
+
+# Deta Base HTTP API, spoken directly over one connection pool shared by every table and thread.
+# The deta package opens a connection per Base that cannot be used by two threads at once;
+# here idle connections are kept alive and reused, so a request rarely pays for a new TLS handshake.
+# Defaults for DETA_BASE_URL, DETA_POOL_SIZE, DETA_CONNECT_TIMEOUT and DETA_READ_TIMEOUT (see get_backend)
+DEFAULT_DETA_BASE_URL = "https://database.deta.sh/v1" # e.g. http://127.0.0.1:8765/v1 for deta_standin.py
+DEFAULT_DETA_POOL_SIZE = 10 # connections kept open; requests beyond this wait for one to free up
+DEFAULT_DETA_CONNECT_TIMEOUT = 5.0
+DEFAULT_DETA_READ_TIMEOUT = 30.0
+# A kept-alive connection the server has dropped fails the next request sent over it. Reads are
+# sent again at once on a fresh connection; writes are retried by write_queue, with backoff.
+DETA_READ_RETRIES = 2
+DETA_READ_METHODS = frozenset({"GET", "POST"}) # POST is only used by fetch (/query)
+
+
+class DetaTable:
+    """One Deta Base, with the same methods and return values as deta.Base"""
+
+    def __init__(self, backend, name):
+        self.backend = backend
+        self.url = f"{backend.base_url}/{backend.project_id}/{name}"
+
+    def _request(self, method, path, body=None, missing_ok=False):
+        """Returns the decoded JSON response; None for a 404 when `missing_ok`"""
+        response = self.backend.pool.request(
+            method,
+            self.url + path,
+            body=json.dumps(body) if body is not None else None,
+            headers=self.backend.headers,
+        )
+        if missing_ok and response.status == 404:
+            return None
+        if response.status >= 400:
+            raise Exception(f"Deta Base {method} {path} failed ({response.status}): {response.data.decode(errors='replace')}")
+        return json.loads(response.data) if response.data else None
+
+    @staticmethod
+    def _key_path(key):
+        return "/items/" + quote(str(key), safe="")
+
+    def put(self, data, key=None):
+        """Returns the stored item"""
+        item = dict(data)
+        if key is not None:
+            item["key"] = key
+        response = self._request("PUT", "/items", {"items": [item]}) or {}
+        stored = response.get("processed", {}).get("items", [])
+        if not stored:
+            failed = response.get("failed", {}).get("items", [])
+            raise Exception(f"Deta Base rejected item '{item.get('key', '')}': {failed or response}")
+        return stored[0]
+
+    def put_many(self, items):
+        """Up to 25 items. Returns {"processed": {"items": [...]}, "failed": {"items": [...]}}"""
+        return self._request("PUT", "/items", {"items": list(items)})
+
+    def get(self, key):
+        """If not found, returns None"""
+        return self._request("GET", self._key_path(key), missing_ok=True)
+
+    def update(self, updates, key):
+        """Sets the given fields. Raises if the key does not exist"""
+        if self._request("PATCH", self._key_path(key), {"set": updates}, missing_ok=True) is None:
+            raise Exception(f"Key '{key}' not found")
+        return None
+
+    def delete(self, key):
+        """Always returns None, even if the key does not exist"""
+        self._request("DELETE", self._key_path(key))
+        return None
+
+    def fetch(self, query=None, limit=1000, last=None):
+        """Returns one page of items matching `query` (a dict, or a list of dicts meaning OR)"""
+        body = {"limit": limit}
+        if query:
+            body["query"] = [query] if isinstance(query, dict) else list(query)
+        if last is not None:
+            body["last"] = last
+        response = self._request("POST", "/query", body)
+        paging = response.get("paging", {})
+        return FetchResponse(paging.get("size", len(response["items"])), paging.get("last"), response["items"])
+
+
+class DetaBackend:
+    def __init__(self, project_key, base_url=DEFAULT_DETA_BASE_URL, pool_size=DEFAULT_DETA_POOL_SIZE,
+                 connect_timeout=DEFAULT_DETA_CONNECT_TIMEOUT, read_timeout=DEFAULT_DETA_READ_TIMEOUT):
+        if not project_key:
+            raise ValueError("DETA_KEY is not set")
+        self.project_id = project_key.split("_")[0]
+        self.base_url = base_url.rstrip("/")
+        self.headers = {"X-API-Key": project_key, "Content-Type": "application/json"}
+        # PoolManager is thread-safe; block=True makes extra threads wait for a free connection
+        # instead of opening (and then throwing away) connections beyond the pool size
+        self.pool = urllib3.PoolManager(
+            num_pools=4,
+            maxsize=pool_size,
+            block=True,
+            timeout=urllib3.Timeout(connect=connect_timeout, read=read_timeout),
+            retries=urllib3.Retry(total=DETA_READ_RETRIES, status=0, redirect=0, allowed_methods=DETA_READ_METHODS, backoff_factor=0.1),
+        )
+
+    def table(self, name):
+        return DetaTable(self, name)
+
+
+# ---- 2. SQLite ----
+
+# Fields copied out of the JSON record into their own indexed columns
+INDEXED_FIELDS = ["date", "period", "category", "updated_at"]
+
+# Deta query operators ("field?op": value) and their SQL equivalent
+QUERY_OPERATORS = {
+    "ne": "!=",
+    "lt": "<",
+    "gt": ">",
+    "lte": "<=",
+    "gte": ">=",
+}
+
+
+class SqliteTable:
+    """A deta.Base look-alike stored in one SQLite table.
+    The whole record is kept as JSON in "data"; the INDEXED_FIELDS are copied out into
+    their own indexed columns so they can be filtered without decoding every row."""
+
+    def __init__(self, backend, name):
+        self.backend = backend
+        self.name = name
+        with backend.lock:
+            conn = backend.connection()
+            conn.execute(f'CREATE TABLE IF NOT EXISTS "{name}" (key TEXT PRIMARY KEY, data TEXT NOT NULL)')
+            existing_columns = [row[1] for row in conn.execute(f'PRAGMA table_info("{name}")')]
+            for field in INDEXED_FIELDS:
+                if field not in existing_columns:
+                    # Older files: add the column and fill it from the stored records
+                    conn.execute(f'ALTER TABLE "{name}" ADD COLUMN "{field}"')
+                    conn.execute(f'UPDATE "{name}" SET "{field}" = ' + self._column_from_data(field))
+                conn.execute(f'CREATE INDEX IF NOT EXISTS "{name}_{field}" ON "{name}" ("{field}")')
+            conn.commit()
+        columns = ", ".join(f'"{field}"' for field in INDEXED_FIELDS)
+        placeholders = ", ".join("?" for _ in INDEXED_FIELDS)
+        self.insert_sql = f'INSERT OR REPLACE INTO "{name}" (key, data, {columns}) VALUES (?, ?, {placeholders})'
+        assignments = ", ".join(f'"{field}" = ?' for field in INDEXED_FIELDS)
+        self.update_sql = f'UPDATE "{name}" SET data = ?, {assignments} WHERE key = ?'
+
+    def _row(self, item):
+        return [item["key"], json.dumps(item, ensure_ascii=False)] + [item.get(field) for field in INDEXED_FIELDS]
+
+    def _column_from_data(self, field):
+        return f"json_extract(data, '$.{field}')"
+
+    def _column(self, field):
+        if field == "key" or field in INDEXED_FIELDS:
+            return f'"{field}"'
+        return self._column_from_data(field)
+
+    def _where(self, query):
+        """Translates a Deta query (a dict, or a list of dicts meaning OR) into a WHERE clause"""
+        clauses = []
+        params = []
+        for condition in query if isinstance(query, list) else [query]:
+            parts = []
+            for field_op, value in condition.items():
+                field, _, op = field_op.partition("?")
+                column = self._column(field)
+                if op == "":
+                    parts.append(f"{column} = ?")
+                    params.append(value)
+                elif op in QUERY_OPERATORS:
+                    parts.append(f"{column} {QUERY_OPERATORS[op]} ?")
+                    params.append(value)
+                elif op == "r":
+                    parts.append(f"{column} BETWEEN ? AND ?")
+                    params.extend(value)
+                elif op == "pfx":
+                    parts.append(f"substr({column}, 1, ?) = ?")
+                    params.extend([len(value), value])
+                elif op == "contains":
+                    parts.append(f"instr({column}, ?) > 0")
+                    params.append(value)
+                else:
+                    raise ValueError(f"Unsupported query operator: {op}")
+            clauses.append("(" + (" AND ".join(parts) or "1") + ")")
+        return " OR ".join(clauses), params
+
+    def put(self, data, key=None):
+        """Returns the stored item, like deta.Base.put"""
+        item = dict(data)
+        item["key"] = str(key or item.get("key") or new_key())
+        conn = self.backend.connection()
+        with conn:
+            conn.execute(self.insert_sql, self._row(item))
+        return item
+
+    def put_many(self, items):
+        """Stores several items in one transaction. Returns the same shape as deta.Base.put_many"""
+        stored = []
+        for data in items:
+            item = dict(data)
+            item["key"] = str(item.get("key") or new_key())
+            stored.append(item)
+        conn = self.backend.connection()
+        with conn:
+            conn.executemany(self.insert_sql, [self._row(item) for item in stored])
+        return {"processed": {"items": stored}}
+
+    def get(self, key):
+        """If not found, returns None"""
+        row = self.backend.connection().execute(
+            f'SELECT data FROM "{self.name}" WHERE key = ?', (key,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, updates, key):
+        """Sets the given fields. Raises if the key does not exist, like deta.Base.update"""
+        conn = self.backend.connection()
+        with conn:
+            row = conn.execute(f'SELECT data FROM "{self.name}" WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                raise Exception(f"Key '{key}' not found")
+            item = json.loads(row[0])
+            item.update(updates)
+            item["key"] = key
+            conn.execute(self.update_sql, self._row(item)[1:] + [key])
+        return None
+
+    def delete(self, key):
+        """Always returns None, even if the key does not exist"""
+        conn = self.backend.connection()
+        with conn:
+            conn.execute(f'DELETE FROM "{self.name}" WHERE key = ?', (key,))
+        return None
+
+    def fetch(self, query=None, limit=1000, last=None):
+        """Returns one page of items matching `query`, ordered by key, starting after `last`"""
+        conditions = []
+        params = []
+        if query:
+            where, params = self._where(query)
+            conditions.append(f"({where})")
+        if last is not None:
+            conditions.append("key > ?")
+            params.append(last)
+        sql = f'SELECT data FROM "{self.name}"'
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY key LIMIT ?"
+        params.append(limit + 1)  # one extra row tells us whether there is another page
+        rows = self.backend.connection().execute(sql, params).fetchall()
+        items = [json.loads(row[0]) for row in rows[:limit]]
+        next_last = items[-1]["key"] if len(rows) > limit else None
+        return FetchResponse(count=len(items), last=next_last, items=items)
+
+
+class SqliteBackend:
+    def __init__(self, path=DEFAULT_SQLITE_PATH):
+        self.path = str(path)
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.local = threading.local()  # one connection per thread; WAL lets readers run alongside a writer
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def table(self, name):
+        return SqliteTable(self, name)
+
+
+def get_backend():
+    """Builds the backend selected by STORAGE_BACKEND (read after .env has been loaded)"""
+    engine = os.getenv("STORAGE_BACKEND", "deta").lower()
+    if engine == "deta":
+        return DetaBackend(
+            os.getenv("DETA_KEY"),
+            base_url=os.getenv("DETA_BASE_URL", DEFAULT_DETA_BASE_URL),
+            pool_size=int(os.getenv("DETA_POOL_SIZE", DEFAULT_DETA_POOL_SIZE)),
+            connect_timeout=float(os.getenv("DETA_CONNECT_TIMEOUT", DEFAULT_DETA_CONNECT_TIMEOUT)),
+            read_timeout=float(os.getenv("DETA_READ_TIMEOUT", DEFAULT_DETA_READ_TIMEOUT)),
+        )
+    if engine == "sqlite":
+        return SqliteBackend(os.getenv("SQLITE_PATH", DEFAULT_SQLITE_PATH))
+    raise ValueError(f"Unknown STORAGE_BACKEND: {engine}")
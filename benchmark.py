@@ -0,0 +1,299 @@
+import glob
+import json
+import os
+import platform
+import sys
+import time
+
+import docx
+import pandas as pd
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+
+import editor_diff
+import exports
+import ledger_generator
+import utils
+import columns_categories_config as ccconfig
+
+# Times the data-heavy parts of the app on generated data, no database needed.
+# Usage: python benchmark.py [rows ...]    e.g. python benchmark.py 1000 10000
+#        python benchmark.py pipelines [size ...] [--baseline results.json]    e.g. python benchmark.py pipelines 1k 100k
+# "pipelines" runs the data steps of each page on a ledger from ledger_generator.py, kept in a local
+# SQLite file, and saves the timings under BENCHMARK_DIR to compare the next run against.
+
+BENCHMARK_DIR = "./data/benchmarks"
+PIPELINE_SIZES = ["1k", "100k"] # "1m" too when asked for: seeding it takes several minutes
+PIPELINE_REPEATS = 3 # each step is run this many times and the fastest run kept
+EXPORT_ROWS = 10_000 # most rows put in the inventory reports, as a Word table of 1m rows takes minutes
+REGRESSION_RATIO = 1.25 # a step this much slower than in the baseline is reported...
+REGRESSION_MIN_SECONDS = 0.01 # ...if it also lost at least this much time; smaller changes are noise
+
+
+def timed(function, *args):
+    """Returns (result, seconds taken) of function(*args)"""
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def sample_inventory(rows):
+    """An inventory export table (as in inventory_page.create_word_report) with `rows` rows"""
+    return pd.DataFrame({
+        "存貨編號": [f"H{i:06d}" for i in range(rows)],
+        "存貨名稱": [f"藥材{i}" for i in range(rows)],
+        "來貨價": [float(i % 500) for i in range(rows)],
+        "零售價": [float(i % 500 + 20) for i in range(rows)],
+        "數量": [i % 80 for i in range(rows)],
+    })
+
+
+def cell_by_cell_table(doc, df):
+    """The previous way of writing a report table, kept here for comparison"""
+    table = doc.add_table(rows=df.shape[0] + 1, cols=df.shape[1])
+    table.style = "Table Grid"
+    for j, col_name in enumerate(df.columns):
+        cell = table.cell(0, j)
+        cell.text = col_name
+        cell.paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.CENTER
+    for i in range(df.shape[0]):
+        for j in range(df.shape[1]):
+            cell = table.cell(i + 1, j)
+            cell.text = str(df.iat[i, j])
+            cell.paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+
+def word_report(add_table, df):
+    doc = docx.Document()
+    doc.add_heading("存貨", level=1)
+    add_table(doc, df)
+    return exports.build_docx(doc)
+
+
+def benchmark_word_tables(sizes, compare_up_to=200):
+    """The cell-by-cell writer slows down with the square of the table size
+    (200 rows already take tens of seconds), so it is only run up to `compare_up_to` rows"""
+    print("Word report table")
+    for rows in sizes:
+        df = sample_inventory(rows)
+        _, bulk_seconds = timed(word_report, exports.add_table, df)
+        line = f"  {rows:>8} rows  add_table: {bulk_seconds:8.3f}s"
+        if rows <= compare_up_to:
+            _, old_seconds = timed(word_report, cell_by_cell_table, df)
+            line += f"  cell by cell: {old_seconds:8.3f}s  ({old_seconds / bulk_seconds:.1f}x)"
+        print(line)
+
+
+def sample_catalog(rows):
+    """An inventory frame as inventory_page shows it in the data editor, indexed by key"""
+    keys = [f"H{i:06d}" for i in range(rows)]
+    return pd.DataFrame({
+        "key": keys,
+        "brand": ["三九", "海天", "其他"] * (rows // 3) + ["三九"] * (rows % 3),
+        "herb_name": [f"藥材{i}" for i in range(rows)],
+        "cost_price": [float(i % 500) for i in range(rows)],
+        "selling_price": [float(i % 500 + 20) for i in range(rows)],
+        "inventory": [i % 80 for i in range(rows)],
+    }, index=keys)
+
+
+def full_frame_diff(old_df, edited_df):
+    """The previous way of finding an edit, kept here for comparison: compare every cell,
+    then take the first changed cell of the first changed row"""
+    different_rows = (old_df != edited_df).any(axis=1)
+    herb_id = old_df[different_rows]['key'].values[0]
+    for col in edited_df.columns:
+        if edited_df[col][different_rows].values[0] != old_df[col][different_rows].values[0]:
+            return {herb_id: {col: edited_df.loc[different_rows, col].values[0]}}
+
+
+def best_of(repeats, function, *args):
+    return min(timed(function, *args)[1] for _ in range(repeats))
+
+
+def benchmark_inventory_diff(rows=50000, edits=10, repeats=5):
+    print(f"Inventory editor diff ({rows} herbs, {edits} edited cells)")
+    df = sample_catalog(rows)
+    edited_rows = {position: {"inventory": float(position % 80 + 1)} for position in range(0, rows, rows // edits)}
+    edited_df = df.copy()
+    for position, row_changes in edited_rows.items():
+        edited_df.iat[position, edited_df.columns.get_loc("inventory")] = row_changes["inventory"]
+
+    changes = editor_diff.diff_edits(df, edited_rows)
+    assert len(changes) == len(edited_rows)
+    keyed_seconds = best_of(repeats, editor_diff.diff_edits, df, edited_rows)
+    full_seconds = best_of(repeats, full_frame_diff, df, edited_df)
+    print(f"  diff_edits: {keyed_seconds * 1000:8.3f}ms  full frame: {full_seconds * 1000:8.3f}ms  ({full_seconds / keyed_seconds:.0f}x)")
+
+
+def seeded_ledger(size, seed):
+    """Path of a SQLite file holding the generated ledger of `size` rows per table, made on first use.
+    A file left by an interrupted run has no ".done" marker next to it and is made again"""
+    import backends
+
+    path = os.path.join(BENCHMARK_DIR, f"ledger-{size}-seed{seed}.db")
+    if not os.path.exists(path + ".done"):
+        for leftover in glob.glob(path + "*"):
+            os.remove(leftover)
+        backend = backends.SqliteBackend(path)
+        rows = ledger_generator.parse_size(size)
+        print(f"  seeding {rows} rows per table into {path}...")
+        tables = {"inventory": "inventory_db", "income": "income_db", "expense": "expense_db"}
+        failed = ledger_generator.seed_tables({table: backend.table(name) for table, name in tables.items()}, rows, seed)
+        if any(failed.values()):
+            raise RuntimeError(f"Rows not written: {failed}")
+        open(path + ".done", "w").close()
+    return path
+
+
+def pipeline_stages(path, repeats):
+    """Times the steps each page takes from the stored rows to what it shows or exports.
+    Returns {step: seconds}"""
+    import backends
+    import database as db
+    import rollup
+    import statistics_page
+    import inventory_page
+
+    backend = backends.SqliteBackend(path)
+    stages = {}
+
+    def measure(name, function, *args):
+        result, seconds = timed(function, *args)
+        stages[name] = min([seconds] + [timed(function, *args)[1] for _ in range(repeats - 1)])
+        return result
+
+    items = {}
+    for table, name in [("inventory", "inventory_db"), ("income", "income_db"), ("expense", "expense_db")]:
+        items[table], stages[f"fetch {table}"] = timed(db.fetch_all, backend.table(name)) # once: it reads the file
+
+    def build_frame(table_items, columns):
+        return pd.DataFrame(table_items, columns=columns, index=[item["key"] for item in table_items])
+
+    # Frames as data_access.TableSync builds them
+    df_inventory = measure("frame inventory", build_frame, items["inventory"], ccconfig.INVENTORY_COLUMN_ORDER)
+    df_income = measure("frame income", build_frame, items["income"], ccconfig.INCOME_COLUMN_ORDER)
+    df_expense = measure("frame expense", build_frame, items["expense"], ccconfig.EXPENSE_COLUMN_ORDER)
+    df_income = measure("months income", lambda: utils.add_month_columns(df_income.copy()))
+    df_expense = measure("months expense", lambda: utils.add_month_columns(df_expense.copy()))
+
+    # Statistics page: monthly roll-ups, category tables, monthly summaries, reports
+    def monthly_rollup(table_items):
+        table_rollup = rollup.MonthlyRollup()
+        table_rollup.rebuild(table_items)
+        return table_rollup.frame()
+
+    income_rollup = measure("rollup income", monthly_rollup, items["income"])
+    expense_rollup = measure("rollup expense", monthly_rollup, items["expense"])
+    income_by_category = measure("pivot income", statistics_page.convert_to_category_table, income_rollup, ccconfig.INCOME_CATEGORIES)
+    expense_by_category = measure("pivot expense", statistics_page.convert_to_category_table, expense_rollup, ccconfig.EXPENSE_CATEGORIES)
+
+    def monthly_summary():
+        merged = pd.merge(
+            statistics_page.convert_to_monthly_summary(income_rollup),
+            statistics_page.convert_to_monthly_summary(expense_rollup),
+            on=["period", "month"], how="outer",
+        ).rename(columns={"amount_x": "Income", "amount_y": "Expense"}).sort_values("period", ignore_index=True)
+        merged["Net Income"] = merged["Income"] - merged["Expense"]
+        return merged
+
+    summary = measure("monthly summary", monthly_summary)
+    statistics_tables = {
+        "收入類別": income_by_category.drop(columns=["period"]),
+        "支出類別": expense_by_category.drop(columns=["period"]),
+        "總收入支出總結": summary.drop(columns=["period"]),
+    }
+    measure("statistics xlsx", exports.build_xlsx, statistics_tables)
+    measure("statistics docx", lambda: exports.build_docx(statistics_page.create_word_report(statistics_tables)))
+
+    # Income page: the latest month, all categories, its pie chart amounts and report
+    latest_month = [utils.month_options(df_income)[-1]]
+    month_rows = measure("income filter", lambda: df_income[
+        df_income["period"].isin(latest_month) & df_income["category"].isin(ccconfig.INCOME_CATEGORIES)
+    ])
+    measure("income by category", lambda: month_rows.groupby("category")["amount"].sum())
+    measure("income xlsx", lambda: exports.build_xlsx({"收入報告": month_rows.drop(columns=utils.MONTH_COLUMNS)}))
+
+    # Inventory page: one table per brand, and the reports (EXPORT_ROWS rows at most)
+    measure("inventory brand tables", lambda: [
+        df_inventory[df_inventory["brand"] == brand][ccconfig.INVENTORY_COLUMN_ORDER].drop(columns=["brand"])
+        for brand in ccconfig.HERB_BRANDS
+    ])
+    report_rows = df_inventory.head(EXPORT_ROWS)
+    report_tables = {
+        f"{brand}存貨": report_rows[report_rows["brand"] == brand].drop(columns=["brand"]).sort_values(by="herb_name").reset_index(drop=True)
+        for brand in ccconfig.HERB_BRANDS
+    }
+    measure("inventory xlsx", exports.build_xlsx, report_tables)
+    measure("inventory docx", lambda: exports.build_docx(inventory_page.create_word_report(report_tables)))
+    return stages
+
+
+def latest_results(before=None):
+    """Path of the newest saved results file (older than `before`, if given), or None"""
+    paths = sorted(glob.glob(os.path.join(BENCHMARK_DIR, "pipelines-*.json")))
+    paths = [path for path in paths if before is None or path < before]
+    return paths[-1] if paths else None
+
+
+def compare_results(results, baseline):
+    """Prints each step that got more than REGRESSION_RATIO times (and REGRESSION_MIN_SECONDS) slower than in `baseline`"""
+    print(f"Compared with {baseline['created']}:")
+    regressions = 0
+    for size, stages in results["sizes"].items():
+        for stage, seconds in stages.items():
+            old_seconds = baseline["sizes"].get(size, {}).get(stage)
+            if old_seconds and seconds > old_seconds * REGRESSION_RATIO and seconds - old_seconds >= REGRESSION_MIN_SECONDS:
+                regressions += 1
+                print(f"  slower: {size} {stage}: {old_seconds:.4f}s -> {seconds:.4f}s ({seconds / old_seconds:.2f}x)")
+    if regressions == 0:
+        print(f"  no step slower than {REGRESSION_RATIO}x")
+    return regressions
+
+
+def benchmark_pipelines(sizes, seed=0, repeats=PIPELINE_REPEATS, baseline_path=None):
+    """Runs pipeline_stages for each size, saves the results as JSON and compares them with
+    `baseline_path` (default: the previous results file). Returns the path of the new file"""
+    os.makedirs(BENCHMARK_DIR, exist_ok=True)
+    # database.py connects on import; point it at a local file, never at Deta
+    os.environ["STORAGE_BACKEND"] = "sqlite"
+    os.environ["SQLITE_PATH"] = os.path.join(BENCHMARK_DIR, "scratch.db")
+
+    results = {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "seed": seed,
+        "repeats": repeats,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "sizes": {},
+    }
+    for size in sizes:
+        print(f"Page pipelines ({size} rows per table)")
+        stages = pipeline_stages(seeded_ledger(size, seed), repeats)
+        for stage, seconds in stages.items():
+            print(f"  {stage:<24} {seconds:9.4f}s")
+        results["sizes"][size] = stages
+
+    path = os.path.join(BENCHMARK_DIR, f"pipelines-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    baseline_path = baseline_path or latest_results(before=path)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"Saved {path}")
+    if baseline_path is not None:
+        with open(baseline_path, encoding="utf-8") as f:
+            compare_results(results, json.load(f))
+    return path
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["pipelines"]:
+        args = sys.argv[2:]
+        baseline_path = None
+        if "--baseline" in args:
+            position = args.index("--baseline")
+            baseline_path = args[position + 1]
+            del args[position:position + 2]
+        benchmark_pipelines(args or PIPELINE_SIZES, baseline_path=baseline_path)
+    else:
+        sizes = [int(arg) for arg in sys.argv[1:]] or [200, 1000, 10000]
+        benchmark_word_tables(sizes)
+        benchmark_inventory_diff()
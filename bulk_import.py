@@ -0,0 +1,172 @@
+import time
+from datetime import date, datetime
+
+import openpyxl  # pip install openpyxl
+import pandas as pd
+import streamlit as st
+
+import database as db
+import data_access
+import utils
+import columns_categories_config as ccconfig
+
+IMPORT_CHUNK_ROWS = 500 # rows read, checked and written per step, so the whole file is never held in memory
+DATE_INPUT_FORMATS = [utils.DATE_FORMAT, "%Y-%m-%d", "%Y/%m/%d"] # e.g. "28-Aug-23", "2023-08-28", "2023/08/28"
+
+TABLES = {
+    "income": {
+        "fields": ccconfig.INCOME_COLUMN_ORDER,
+        "categories": ccconfig.INCOME_CATEGORIES,
+        "required": ["date", "category", "item", "customer", "amount"],
+        "insert": db.insert_incomes,
+    },
+    "expense": {
+        "fields": ccconfig.EXPENSE_COLUMN_ORDER,
+        "categories": ccconfig.EXPENSE_CATEGORIES,
+        "required": ["date", "category", "item", "amount"],
+        "insert": db.insert_expenses,
+    },
+}
+
+
+def read_chunks(file, file_name):
+    """Yields (rows, fraction of the file read so far) from a .csv or .xlsx file, IMPORT_CHUNK_ROWS rows
+    at a time. Each row is a {column title: value} dict; the first line of the file holds the titles."""
+    if file_name.lower().endswith(".xlsx"):
+        workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+        try:
+            worksheet = workbook.worksheets[0]
+            total_rows = worksheet.max_row or 0 # from the sheet's dimensions, if the file records them
+            rows = worksheet.iter_rows(values_only=True)
+            header = [str(value).strip() if value is not None else "" for value in next(rows, ())]
+            chunk = []
+            rows_read = 1
+            for values in rows:
+                rows_read += 1
+                if all(value is None or value == "" for value in values):
+                    continue
+                chunk.append(dict(zip(header, values)))
+                if len(chunk) == IMPORT_CHUNK_ROWS:
+                    yield chunk, min(rows_read / total_rows, 1.0) if total_rows else 0.0
+                    chunk = []
+            if chunk:
+                yield chunk, 1.0
+        finally:
+            workbook.close()
+    else:
+        size = getattr(file, "size", 0)
+        for df in pd.read_csv(file, chunksize=IMPORT_CHUNK_ROWS, dtype=str, keep_default_na=False, encoding="utf-8-sig"):
+            df.columns = [str(column).strip() for column in df.columns]
+            yield df.to_dict("records"), min(file.tell() / size, 1.0) if size else 0.0
+
+
+def parse_date(value):
+    """Returns the date in utils.DATE_FORMAT, or None if it can't be read"""
+    if isinstance(value, (datetime, date)):
+        return value.strftime(utils.DATE_FORMAT)
+    text = str(value).strip()
+    for date_format in DATE_INPUT_FORMATS:
+        try:
+            return datetime.strptime(text, date_format).strftime(utils.DATE_FORMAT)
+        except ValueError:
+            pass
+    return None
+
+
+def parse_amount(value):
+    """Returns the amount as an int if it is whole, otherwise a float; None if it isn't a number >= 0"""
+    try:
+        amount = float(str(value).replace(",", "").replace("$", "").strip())
+    except ValueError:
+        return None
+    if amount != amount or amount < 0: # NaN or negative
+        return None
+    return int(amount) if amount.is_integer() else amount
+
+
+def validate_row(table, row, column_titles):
+    """Returns (record, None) for a valid row, otherwise (None, reason).
+    Columns may be titled with the field names ("date") or the page's column titles ("日期")."""
+    spec = TABLES[table]
+    values = {}
+    for field in spec["fields"]:
+        value = row.get(field, row.get(column_titles.get(field)))
+        if isinstance(value, float) and value.is_integer():
+            value = int(value) # Excel keeps numbers as floats, e.g. an id of 1001
+        values[field] = "" if value is None else value
+
+    missing = [column_titles.get(field, field) for field in spec["required"] if str(values[field]).strip() == ""]
+    if missing:
+        return None, f"缺少{'、'.join(missing)}"
+    record = {field: str(values[field]).strip() for field in spec["fields"]}
+    if not record["key"]:
+        del record["key"] # the database makes one up
+    record["date"] = parse_date(values["date"])
+    if record["date"] is None:
+        return None, f"日期格式不正確：{values['date']}"
+    if record["category"] not in spec["categories"]:
+        return None, f"會計項目不存在：{record['category']}"
+    record["amount"] = parse_amount(values["amount"])
+    if record["amount"] is None:
+        return None, f"金額不正確：{values['amount']}"
+    return record, None
+
+
+def import_file(table, file, file_name, column_titles, on_progress=None):
+    """Imports every valid row of a .csv/.xlsx file into "income" or "expense".
+    Rows whose key already exists replace the stored item, so a file can be imported again safely.
+    on_progress(fraction read, rows written), if given, is called after each chunk.
+    Returns a dict with "imported", "rejected" [(line number, reason)], "failed" (rows the database
+    did not accept) and "seconds"."""
+    start = time.perf_counter()
+    result = {"imported": 0, "rejected": [], "failed": 0, "seconds": 0.0}
+    line_number = 1 # the title line
+    for rows, fraction in read_chunks(file, file_name):
+        records = []
+        for row in rows:
+            line_number += 1
+            record, reason = validate_row(table, row, column_titles)
+            if reason is None:
+                records.append(record)
+            else:
+                result["rejected"].append((line_number, reason))
+        if records:
+            stored, failed = TABLES[table]["insert"](records)
+            data_access.apply_put_many(table, stored)
+            result["imported"] += len(stored)
+            result["failed"] += sum(len(items) for items, _ in failed)
+        if on_progress is not None:
+            on_progress(fraction, result["imported"])
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def import_section(table, column_titles):
+    """Shows a file uploader that imports a .csv or .xlsx file into "income" or "expense".
+    `column_titles` maps field names to the titles used by the page's Excel report,
+    so a downloaded report can be imported back as it is."""
+    result_key = f"{table}_import_result"
+    result = st.session_state.pop(result_key, None)
+    if result is not None:
+        rows_per_second = result["imported"] / result["seconds"] if result["seconds"] else 0
+        st.success(f"已匯入 {result['imported']} 項，用時 {result['seconds']:.1f} 秒（每秒 {rows_per_second:.0f} 項）")
+        if result["failed"]:
+            st.error(f"{result['failed']} 項未能寫入數據庫，請重新匯入。")
+        if result["rejected"]:
+            st.warning(f"{len(result['rejected'])} 行格式不正確，未有匯入：")
+            st.dataframe(pd.DataFrame(result["rejected"], columns=["行數", "原因"]), hide_index=True, use_container_width=True)
+
+    st.caption(f"第一行為欄位名稱：{'、'.join(column_titles.values())}（編號可留空）")
+    uploaded_file = st.file_uploader("選擇CSV或Excel文件", type=["csv", "xlsx"], key=f"{table}_import_file")
+    if uploaded_file is not None and st.button("開始匯入", key=f"{table}_import_start"):
+        progress = st.progress(0.0, text="正在匯入...")
+        try:
+            result = import_file(
+                table, uploaded_file, uploaded_file.name, column_titles,
+                on_progress=lambda fraction, imported: progress.progress(fraction, text=f"正在匯入...已寫入 {imported} 項"),
+            )
+        except Exception as e:
+            st.error(f"匯入文件時發生錯誤：{e}")
+            return
+        st.session_state[result_key] = result
+        st.experimental_rerun() # show the tables with the new rows, then the result above
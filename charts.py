@@ -0,0 +1,75 @@
+import io
+import os
+from functools import lru_cache
+
+from matplotlib import font_manager
+from matplotlib.figure import Figure
+
+# Charts are drawn on standalone Figure objects rather than through pyplot, so no figure
+# is ever registered with pyplot's global state: each one is freed as soon as its PNG is
+# written. The PNGs are cached by their inputs (plain tuples of the numbers drawn), so a
+# rerun that leaves a chart's data and filters unchanged does not draw it again.
+
+CHART_CACHE_SIZE = 64 # PNGs kept, least recently used dropped first
+SAVEFIG_OPTIONS = {"format": "png", "dpi": 200, "bbox_inches": "tight"} # same as st.pyplot
+FONT_PATH = "./fonts/SimHei.ttf"
+FONT_SIZE = 14
+
+
+def register_chinese_font():
+    """Adds SimHei to matplotlib's font manager and returns the FontProperties every chart uses.
+    Runs once, when this module is first imported; afterwards text refers to the font by
+    family name, and matplotlib's own caches resolve it without reading the .ttf again."""
+    if not os.path.exists(FONT_PATH):
+        return font_manager.FontProperties(size=FONT_SIZE) # charts still draw, without Chinese glyphs
+    font_manager.fontManager.addfont(FONT_PATH)
+    family = font_manager.FontProperties(fname=FONT_PATH).get_name() # "SimHei"
+    fontP = font_manager.FontProperties(family=family, size=FONT_SIZE)
+    font_manager.findfont(fontP) # warm the family -> file lookup cache
+    return fontP
+
+
+CHINESE_FONT = register_chinese_font() # shared by all charts, never modified
+
+
+def to_png(fig):
+    buffer = io.BytesIO()
+    fig.savefig(buffer, **SAVEFIG_OPTIONS)
+    return buffer.getvalue()
+
+
+@lru_cache(maxsize=CHART_CACHE_SIZE)
+def pie_chart(title, amounts):
+    """PNG of a pie chart. `amounts` is a tuple of (label, amount) pairs"""
+    fontP = CHINESE_FONT
+    fig = Figure(figsize=(8, 6))
+    ax = fig.subplots()
+    wedges, texts, autotexts = ax.pie(
+        [value for _, value in amounts],
+        labels=[f"{label} (${value:.2f})" for label, value in amounts],
+        autopct="%1.1f%%",
+    )
+    ax.set_title(title, fontproperties=fontP)
+    for text in texts:
+        text.set_fontproperties(fontP)
+    for autotext in autotexts:
+        autotext.set_size(10)
+        autotext.set_weight("bold")
+    return to_png(fig)
+
+
+@lru_cache(maxsize=CHART_CACHE_SIZE)
+def line_chart(title, months, series, legend_loc=0):
+    """PNG of a line chart over `months` (a tuple of month labels).
+    `series` is a tuple of (label, marker, values) with one value per month"""
+    fontP = CHINESE_FONT
+    fig = Figure(figsize=(10, 4))
+    ax = fig.subplots()
+    ax.set_title(title, fontproperties=fontP)
+    for label, marker, values in series:
+        ax.plot(months, values, marker=marker, label=label)
+    ax.set_xlabel('月份', fontproperties=fontP)
+    ax.set_ylabel('金額', fontproperties=fontP)
+    ax.legend(loc=legend_loc, prop=fontP)
+    ax.grid(True)
+    return to_png(fig)
@@ -1,5 +1,13 @@
 # Inventory page
 HERB_BRANDS = ["三九", "海天", "其他"]
+HERB_NAMES = [
+    "人蔘", "黃芪", "陳皮", "白芍", "當歸",
+    "甘草", "桂枝", "川芎", "熟地黃", "五味子",
+    "黃連", "枸杞子", "柴胡", "茯苓", "麥門冬",
+    "防風", "金櫻子", "白朮", "艾葉", "連翹",
+    "川貝", "山藥", "田七", "玄參", "阿膠",
+    "山茱萸", "蒲公英", "槐花", "玉竹", "天麻"
+] # used by ledger_generator.py
 INVENTORY_COLUMN_ORDER = ["key", "brand", "herb_name", "cost_price", "selling_price", "inventory"] # same no. of columns as inventory_db, just in different order
 
 # Income page
@@ -11,6 +19,12 @@ INCOME_COLUMN_ORDER = ["key", "date", "category", "item", "customer", "amount"]
 EXPENSE_CATEGORIES = ["租金", "人工", "訂貨", "水電", "宣傳", "交通", "其他"]
 EXPENSE_COLUMN_ORDER = ["key", "date", "category", "item", "amount"] # same no. of columns as expense_db, just in different order
 
+# Tables
+TABLE_PAGE_SIZE = 50 # rows sent to the browser per page of a listing
+
+# Exports
+EXPORT_CACHE_MAX_BYTES = 64 * 1024 * 1024 # generated xlsx/docx files kept for reuse, least recently used dropped first
+
 # messages
 SUCCESS_MSG = "更新成功！現在刷新頁面..."
 WARNING_MSG_FILL_ALL = "請填寫所有必填字段。"
@@ -0,0 +1,317 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import database as db
+import utils
+from rollup import MonthlyRollup
+import columns_categories_config as ccconfig
+
+# In-memory copies of the bases, shared by every session of this process.
+# The first read of a table downloads it in full; after that only the rows whose
+# "updated_at" stamp is at or after the last sync are pulled (see db.fetch_changed).
+# Deletes come in the same way, as tombstones (see db.tombstone).
+# Writes made through this process are applied to the copy as soon as the backend
+# confirms them (apply_put / apply_update / apply_delete), so no read is needed afterwards.
+
+# Stamps are written by each client's own clock, so re-read a little before the last sync
+CLOCK_SKEW_SECONDS = 5
+# How often to ask the base for rows written by other processes
+SYNC_INTERVAL_SECONDS = int(os.getenv("SYNC_INTERVAL_SECONDS", "30"))
+
+
+def same_record(a, b):
+    """True if two records only differ by their modification stamp"""
+    return {k: v for k, v in a.items() if k != "updated_at"} == {k: v for k, v in b.items() if k != "updated_at"}
+
+
+class TableSync:
+    """Keeps the last full snapshot of one base, tops it up with the rows changed since,
+    and keeps a DataFrame of it (indexed by key) patched in place on every change"""
+
+    def __init__(self, base, columns, derive=None, rollup=None):
+        self.base = base
+        self.columns = columns
+        self.derive = derive  # adds computed columns to the frame, e.g. utils.add_month_columns
+        self.rollup = rollup  # a MonthlyRollup kept in step with every change, if given
+        self.items = {}  # key -> record
+        self.watermark = None  # time.time() of the last sync, minus CLOCK_SKEW_SECONDS
+        self.loaded_at = None  # time.time() of the last full load
+        self.synced_at = None  # time.time() of the last full load or delta
+        self.sorted_items = None  # records in key order, rebuilt only after a change
+        self.df = None  # built on first use, then patched row by row
+        self.lock = threading.Lock()
+
+    def sync(self):
+        """Brings the snapshot up to date. Returns True if anything changed"""
+        started = time.time()
+        # Tombstones older than db.TOMBSTONE_SECONDS may be gone: after that long, read everything again
+        if self.loaded_at is None or started - self.watermark > db.TOMBSTONE_SECONDS:
+            self.items = {item["key"]: item for item in db.fetch_all(self.base)}
+            self.sorted_items = None
+            self.df = None
+            if self.rollup is not None:
+                self.rollup.rebuild(self.items.values())
+            self.loaded_at = started
+            changed = True
+        elif started - self.synced_at > SYNC_INTERVAL_SECONDS:
+            changed = False
+            for item in db.fetch_changed(self.base, self.watermark):
+                old_item = self.items.get(item["key"])
+                if db.is_tombstone(item):
+                    if old_item is not None:
+                        self.drop(item["key"])
+                        changed = True
+                elif old_item is None or not same_record(old_item, item):
+                    self.store(item)
+                    changed = True
+        else:
+            return False
+        self.synced_at = started
+        self.watermark = started - CLOCK_SKEW_SECONDS
+        return changed
+
+    def store(self, item):
+        key = item["key"]
+        old_item = self.items.get(key)
+        is_new = old_item is None
+        self.items[key] = item
+        self.sorted_items = None
+        if self.rollup is not None:
+            if not is_new:
+                self.rollup.remove(old_item)
+            self.rollup.add(item)
+        if self.df is not None:
+            row = self.build_frame([item], [key])
+            if is_new:
+                self.df.loc[key] = row.loc[key]
+            else:
+                self.df.loc[key, row.columns] = row.loc[key]
+
+    def store_many(self, items):
+        """store() for a large batch: the frame is rebuilt on next use instead of patched row by row"""
+        self.df = None
+        for item in items:
+            self.store(item)
+
+    def drop(self, key):
+        old_item = self.items.pop(key, None)
+        if old_item is not None:
+            self.sorted_items = None
+            if self.rollup is not None:
+                self.rollup.remove(old_item)
+            if self.df is not None:
+                self.df.drop(index=key, inplace=True)
+
+    def records(self):
+        """Returns every record in key order"""
+        if self.sorted_items is None:
+            self.sorted_items = [self.items[key] for key in sorted(self.items)]
+        return self.sorted_items
+
+    def build_frame(self, items, keys):
+        df = pd.DataFrame(items, columns=self.columns, index=keys)
+        if self.derive is not None:
+            df = self.derive(df)
+        return df
+
+    def frame(self):
+        """Returns a copy of the DataFrame, so the caller may add columns to it"""
+        if self.df is None:
+            items = self.records()
+            self.df = self.build_frame(items, [item["key"] for item in items])
+        return self.df.copy()
+
+
+TABLES = {
+    "inventory": TableSync(db.inventory_db, ccconfig.INVENTORY_COLUMN_ORDER),
+    "income": TableSync(db.income_db, ccconfig.INCOME_COLUMN_ORDER, derive=utils.add_month_columns, rollup=MonthlyRollup()),
+    "expense": TableSync(db.expense_db, ccconfig.EXPENSE_COLUMN_ORDER, derive=utils.add_month_columns, rollup=MonthlyRollup()),
+}
+
+# One counter per table, bumped on every change to it. Cached functions take the versions of
+# the tables they read as arguments, so a write only invalidates what that table feeds.
+versions = {table: 0 for table in TABLES}
+versions_lock = threading.Lock()
+
+
+def version(table):
+    return versions[table]
+
+
+def bump(table):
+    with versions_lock:
+        versions[table] += 1
+
+
+def synced(table):
+    """Returns the TableSync of a table, brought up to date first. Call with its lock held"""
+    table_sync = TABLES[table]
+    if table_sync.sync():
+        bump(table)
+    return table_sync
+
+
+def records(table):
+    """Returns all records of "inventory", "income" or "expense" in key order"""
+    with TABLES[table].lock:
+        return synced(table).records()
+
+
+def stamped(df, table, read_at=None):
+    """Records in df.attrs["source"] the table and version its rows come from, and when they were read
+    from the database if not from the in-memory copy. exports.data_signature uses it instead of hashing
+    the rows. Call with the table's lock held, as every change bumps the version under it"""
+    df.attrs["source"] = (table, version(table), read_at)
+    return df
+
+
+def frame(table):
+    """Returns all records of a table as a DataFrame in the table's column order"""
+    with TABLES[table].lock:
+        return stamped(synced(table).frame(), table)
+
+
+# Set by mutations to its WriteQueue.unsaved: unsaved_writes(table) gives the changes queued for
+# the database but not written yet. Reads the database answers itself (a table not in memory)
+# lay them over what it returns, so a change shows at once whether or not the table is loaded.
+unsaved_writes = lambda table: []
+
+
+def overlay(items, writes, periods=None, categories=None):
+    """Lays `writes` ((kind, key, payload), oldest first) over `items` read from the database
+    and returns the result in key order, keeping the rows in `periods` and `categories` (None means all)"""
+    if not writes:
+        return items
+    by_key = {item["key"]: item for item in items}
+    for kind, key, payload in writes:
+        if kind == "put":
+            by_key[key] = payload
+        elif kind == "update" and key in by_key:
+            by_key[key] = {**by_key[key], **payload}
+        elif kind == "delete":
+            by_key.pop(key, None)
+        if kind != "delete" and "date" in payload and key in by_key: # a new date may move it to another month
+            by_key[key] = {**by_key[key], "period": utils.date_period(payload["date"])}
+    return [
+        item for key, item in sorted(by_key.items())
+        if (periods is None or item.get("period") in periods) and (categories is None or item.get("category") in categories)
+    ]
+
+
+def query(table, periods=None, categories=None):
+    """Returns the rows of "income" or "expense" in the given periods and categories (None means all).
+    Filtered in memory once the table has been loaded, otherwise by the backend (see db.fetch_filtered),
+    so a cold page showing one month only downloads that month"""
+    table_sync = TABLES[table]
+    with table_sync.lock:
+        if table_sync.loaded_at is not None:
+            df = stamped(synced(table).frame(), table)
+            if periods is not None:
+                df = df[df["period"].isin(periods)]
+            if categories is not None:
+                df = df[df["category"].isin(categories)]
+            return df
+    read_at = time.time()
+    unsaved = unsaved_writes(table) # taken before the read, so a write finishing meanwhile is in one or the other
+    db.ensure_periods(table) # rows written before "period" existed would not match the filter
+    items = overlay(db.fetch_filtered(table_sync.base, periods, categories), unsaved, periods, categories)
+    with table_sync.lock:
+        return stamped(table_sync.build_frame(items, [item["key"] for item in items]), table, read_at)
+
+
+def month_options(table):
+    """Returns the periods "income" or "expense" has rows in, oldest first"""
+    table_sync = TABLES[table]
+    with table_sync.lock:
+        if table_sync.loaded_at is not None:
+            return utils.month_options(synced(table).rollup.frame())
+    unsaved = unsaved_writes(table)
+    db.ensure_periods(table) # marks the months of rows written before periods_db existed
+    periods = db.fetch_periods(table)
+    if not periods:
+        # Nothing in periods_db (e.g. it could not be written to): read the table itself
+        with table_sync.lock:
+            return utils.month_options(synced(table).rollup.frame())
+    # Months of rows not written yet, which periods_db only gets with the write
+    new_periods = {utils.date_period(payload["date"]) for kind, key, payload in unsaved if kind != "delete" and "date" in payload}
+    return sorted(set(periods) | new_periods)
+
+
+def is_loaded(table):
+    """True once a table's snapshot has been downloaded"""
+    return TABLES[table].loaded_at is not None
+
+
+def item(table, key):
+    """Returns the record of `key` in the snapshot (None if absent or not loaded), without syncing"""
+    with TABLES[table].lock:
+        return TABLES[table].items.get(key)
+
+
+def reload(table):
+    """Makes the next read of a table download it in full again, e.g. when the copy may be wrong"""
+    with TABLES[table].lock:
+        TABLES[table].loaded_at = None
+        bump(table)
+
+
+def exists(table, key):
+    table_sync = TABLES[table]
+    with table_sync.lock:
+        if table_sync.loaded_at is not None:
+            return key in synced(table).items
+    unsaved = [kind for kind, unsaved_key, payload in unsaved_writes(table) if unsaved_key == key]
+    if unsaved and unsaved[-1] != "update":
+        return unsaved[-1] == "put"
+    return db.get_item(table, key) is not None
+
+
+def rollup(table):
+    """Returns the monthly roll-up of "income" or "expense": columns period, category, amount, count"""
+    with TABLES[table].lock:
+        return synced(table).rollup.frame()
+
+
+def read_many(read, names):
+    """Runs read(name), e.g. frame or rollup, for several tables at the same time.
+    Returns ({name: result}, seconds taken)"""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(names)) as executor:
+        futures = {name: executor.submit(read, name) for name in names}
+        results = {name: future.result() for name, future in futures.items()}
+    return results, time.perf_counter() - start
+
+
+# ---- Write-through: call these only after the backend has accepted the write ----
+
+def apply_put(table, item):
+    """`item` is what db.insert_* returned"""
+    with TABLES[table].lock:
+        TABLES[table].store(item)
+        bump(table) # under the lock, so a frame read with the change never carries the old version
+
+
+def apply_put_many(table, items):
+    """`items` are the stored items returned by db.insert_incomes / db.insert_expenses"""
+    with TABLES[table].lock:
+        TABLES[table].store_many(items)
+        bump(table)
+
+
+def apply_update(table, key, updates):
+    table_sync = TABLES[table]
+    with table_sync.lock:
+        if key in table_sync.items:
+            table_sync.store({**table_sync.items[key], **updates})
+        bump(table)
+
+
+def apply_delete(table, key):
+    """The tombstone the delete left comes back in the next delta, which then finds nothing to drop"""
+    with TABLES[table].lock:
+        TABLES[table].drop(key)
+        bump(table)
@@ -1,98 +1,326 @@
 import os
-import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from deta import Deta  # pip install deta
 from dotenv import load_dotenv  # pip install python-dotenv
-import columns_categories_config as ccconfig
+import backends
+import metrics
+import utils
+
+# The functions below marked @metrics.timed report their time, pages, rows and errors to metrics.py
 
 # Load the environment variables
 load_dotenv(".env")
 DETA_KEY = os.getenv("DETA_KEY")
 
-# Initialize with a project key
-deta = Deta(DETA_KEY)
+# Connect to the storage backend chosen by STORAGE_BACKEND ("deta" or "sqlite")
+backend = backends.get_backend()
 
 # This is how to create/connect a database
-inventory_db = deta.Base("inventory_db")
-income_db = deta.Base("income_db")
-expense_db = deta.Base("expense_db")
-users_db = deta.Base("users_db")
+inventory_db = backend.table("inventory_db")
+income_db = backend.table("income_db")
+expense_db = backend.table("expense_db")
+users_db = backend.table("users_db")
+periods_db = backend.table("periods_db") # which months each table has rows in, see mark_period
+
+# Number of items requested per page when walking a whole base (Deta allows up to 1000)
+FETCH_PAGE_SIZE = int(os.getenv("FETCH_PAGE_SIZE", "100"))
+# Most items deta.Base.put_many accepts in one call
+PUT_MANY_LIMIT = 25
+# How many writes put_many (and mutations) send at the same time
+WRITE_WORKERS = int(os.getenv("WRITE_WORKERS", "4"))
+# How long the user list read by the login form is reused before users_db is read again
+USERS_TTL_SECONDS = int(os.getenv("USERS_TTL_SECONDS", "300"))
+
+
+@metrics.timed
+def fetch_query(base, query=None, page_size=None):
+    """Returns every item of a base matching a Deta query (None for all), walking it page by page"""
+    all_items = []
+    last_item_key = None
+    while True:
+        response = base.fetch(query, limit=page_size or FETCH_PAGE_SIZE, last=last_item_key)
+        metrics.count_page()
+        all_items.extend(response.items)
+        if not response.last:
+            break
+        last_item_key = response.last
+    return all_items
+
+
+@metrics.timed
+def fetch_all(base, page_size=None):
+    """Returns a list of every item in a base, walking it page by page. Tombstones are left out,
+    and the ones older than TOMBSTONE_SECONDS are deleted in the background"""
+    items = fetch_query(base, None, page_size)
+    cutoff = time.time() - TOMBSTONE_SECONDS
+    expired = [item["key"] for item in items if is_tombstone(item) and item.get("updated_at", 0) < cutoff]
+    if expired:
+        threading.Thread(target=purge_tombstones, args=(base, expired), daemon=True).start()
+    return live(items)
+
+
+@metrics.timed
+def fetch_changed(base, since, page_size=None):
+    """Returns the items put, updated or deleted (as tombstones) at or after `since` (a time.time() stamp)"""
+    return fetch_query(base, {"updated_at?gte": since}, page_size)
+
+
+@metrics.timed
+def fetch_filtered(base, periods=None, categories=None, page_size=None):
+    """Returns the items of income_db / expense_db in the given periods and categories (None means all).
+    The backend only sends back rows between the first and last period asked for;
+    the exact month selection is applied here."""
+    if (periods is not None and len(periods) == 0) or (categories is not None and len(categories) == 0):
+        return []
+    condition = {}
+    if periods is not None:
+        condition["period?r"] = [min(periods), max(periods)]
+    if categories is not None:
+        query = [{**condition, "category": category} for category in categories] # a list of conditions means OR
+    else:
+        query = condition or None
+    items = live(fetch_query(base, query, page_size))
+    if periods is not None:
+        wanted = set(periods)
+        items = [item for item in items if item.get("period") in wanted]
+    return items
+
+
+marked_periods = set() # (table, period) pairs already written to periods_db by this process
+
+
+@metrics.timed
+def mark_period(table, date):
+    """Records in periods_db that `table` has rows in the month of `date`,
+    so the list of months can be read without scanning the table. Returns the period"""
+    period = utils.date_period(date)
+    if (table, period) not in marked_periods:
+        periods_db.put({"key": f"{table}-{period}", "table": table, "period": period})
+        marked_periods.add((table, period))
+    return period
+
+
+@metrics.timed
+def fetch_periods(table):
+    """Returns the sorted periods that `table` ("income" or "expense") has rows in"""
+    return sorted(item["period"] for item in fetch_query(periods_db, {"table": table}))
+
+
+@metrics.timed
+def unmark_period_if_empty(table, base, period):
+    """Drops `table`'s month from periods_db once no row of `table` is left in it,
+    so a month emptied by deletes or date changes is no longer offered"""
+    if period is None:
+        return
+    # Deta filters each page after reading it, so a page can come back empty with more to read
+    last_item_key = None
+    while True:
+        response = base.fetch({"period": period}, limit=1, last=last_item_key)
+        metrics.count_page()
+        if response.items:
+            return
+        if not response.last:
+            break
+        last_item_key = response.last
+    periods_db.delete(f"{table}-{period}")
+    marked_periods.discard((table, period))
+
+
+def backfill_periods(table, base):
+    """Gives "period" to rows written before that field existed, and marks every month in periods_db"""
+    for item in fetch_all(base):
+        if "period" not in item:
+            base.update({"period": mark_period(table, item["date"])}, item["key"])
+        else:
+            mark_period(table, item["date"])
+
+
+backfilled_tables = set() # tables this process knows to be backfilled
+backfill_lock = threading.Lock()
+
+
+@metrics.timed
+def ensure_periods(table):
+    """Runs backfill_periods for "income" or "expense" once, the first time any process needs
+    the "period" field (filters and the month list rely on it), and records that in periods_db"""
+    if table in backfilled_tables:
+        return
+    with backfill_lock:
+        if table in backfilled_tables:
+            return
+        marker_key = f"{table}-backfilled" # no "table" field, so fetch_periods does not list it
+        if periods_db.get(marker_key) is None:
+            backfill_periods(table, BASES[table])
+            periods_db.put({"key": marker_key, "backfilled_at": time.time()})
+        backfilled_tables.add(table)
+
+
+def new_key():
+    """Key for an item whose id was left blank, made up here so it is known before the write"""
+    return backends.new_key()
+
+
+def stamp(updates):
+    """Adds the modification stamp that fetch_changed looks for"""
+    return {**updates, "updated_at": time.time()}
+
+
+# A deleted row is replaced by a tombstone, {"key", "deleted": True, "updated_at"}, so the delete
+# reaches other processes' delta syncs (fetch_changed) like any other change. Every other read
+# leaves tombstones out. fetch_all deletes the ones older than TOMBSTONE_SECONDS, and a process
+# that has not synced for that long reads the table in full instead (see data_access.TableSync)
+TOMBSTONE_SECONDS = int(os.getenv("TOMBSTONE_SECONDS", str(7 * 24 * 3600)))
+
+
+def tombstone(key):
+    return stamp({"key": key, "deleted": True})
+
+
+def is_tombstone(item):
+    return item is not None and item.get("deleted") is True
+
+
+def live(items):
+    """`items` without the tombstones"""
+    return [item for item in items if not is_tombstone(item)]
+
+
+@metrics.timed
+def purge_tombstones(base, keys):
+    """Deletes the tombstones of `keys` for good"""
+    for key in keys:
+        base.delete(key)
+
+
+@metrics.timed
+def put_many(base, items):
+    """Writes items in batches of PUT_MANY_LIMIT, WRITE_WORKERS batches at a time.
+    Returns (stored items, [(failed items, error message), ...])"""
+    batches = [items[i:i + PUT_MANY_LIMIT] for i in range(0, len(items), PUT_MANY_LIMIT)]
+    stored = []
+    failed = []
+    with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as executor:
+        put_batch = metrics.bind(base.put_many) # counted towards this call, not lost on the worker threads
+        futures = {executor.submit(put_batch, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            try:
+                response = future.result()
+            except Exception as e:
+                failed.append((futures[future], str(e)))
+                continue
+            stored.extend(response["processed"]["items"])
+            if response.get("failed", {}).get("items"):
+                failed.append((response["failed"]["items"], "rejected by the database"))
+    return stored, failed
+
+
+# ---- Any table, by name (used by the write queue, see mutations.py) ----
+BASES = {"inventory": inventory_db, "income": income_db, "expense": expense_db}
+DATED_TABLES = ["income", "expense"] # their items carry a "period" worked out from "date"
+
+
+@metrics.timed
+def put_item(table, item):
+    """Returns the stored item, like the insert_* functions"""
+    if table in DATED_TABLES:
+        item = {**item, "period": mark_period(table, item["date"])}
+    return BASES[table].put(stamp(item))
+
+
+@metrics.timed
+def update_item(table, key, updates):
+    """If the item is updated, returns None. Otherwise, an exception is raised"""
+    if table in DATED_TABLES and "date" in updates:
+        old_item = BASES[table].get(key)
+        if old_item is None or is_tombstone(old_item):
+            raise Exception(f"Key '{key}' not found")
+        updates = {**updates, "period": mark_period(table, updates["date"])}
+        result = BASES[table].update(stamp(updates), key)
+        if old_item.get("period") != updates["period"]:
+            unmark_period_if_empty(table, BASES[table], old_item.get("period"))
+        return result
+    return BASES[table].update(stamp(updates), key)
+
+
+@metrics.timed
+def get_item(table, key):
+    """If not found (or deleted), returns None"""
+    item = BASES[table].get(key)
+    return None if is_tombstone(item) else item
+
+
+@metrics.timed
+def delete_item(table, key):
+    """Always returns None, even if the key does not exist. Leaves a tombstone in its place"""
+    if table in DATED_TABLES:
+        old_item = BASES[table].get(key)
+        BASES[table].put(tombstone(key))
+        if old_item is not None:
+            unmark_period_if_empty(table, BASES[table], old_item.get("period"))
+        return None
+    BASES[table].put(tombstone(key))
+    return None
 
 
 # ---- 1. inventory_db ----
 
+@metrics.timed
 def insert_herb(herb_id, brand, herb_name, cost_price, selling_price, inventory):
     """Returns the user on a successful user creation, otherwise raises and error"""
     return inventory_db.put(
-        {
+        stamp({
             "key": herb_id,
             "brand": brand,
             "herb_name": herb_name,
             "cost_price": cost_price,
             "selling_price": selling_price,
             "inventory": inventory,
-        }
+        })
     )
 
 # Insert 1 herb manually
 # print(insert_herb("h1", "三九", "herb-1001", 100, 200, 10))
 
-# Insert many herbs
-brand_list = ccconfig.HERB_BRANDS
-chinese_herbs = [
-    "人蔘", "黃芪", "陳皮", "白芍", "當歸",
-    "甘草", "桂枝", "川芎", "熟地黃", "五味子",
-    "黃連", "枸杞子", "柴胡", "茯苓", "麥門冬",
-    "防風", "金櫻子", "白朮", "艾葉", "連翹",
-    "川貝", "山藥", "田七", "玄參", "阿膠",
-    "山茱萸", "蒲公英", "槐花", "玉竹", "天麻"
-]
-# for id in range(1, 31): # loop from 1 to 30
-#     brand = random.choice(brand_list)
-#     herb_name = random.choice(chinese_herbs)
-#     result = insert_herb(f"h0{id}", brand, herb_name, 100, 200, 10)
-#     print(result)
-
-
-
-def fetch_all_herbs():
+# Insert many herbs (and incomes and expenses): see ledger_generator.py, e.g.
+# python ledger_generator.py 1k
+
+
+
+@metrics.timed
+def fetch_all_herbs(page_size=None):
     """Returns a dict of all herbs"""
-    all_herbs = []
-    last_item_key = None
-    while True:
-        response = inventory_db.fetch(limit=100, last=last_item_key)
-        # print(len(response.items))
-        all_herbs.extend(response.items)
-        if not response.last:
-            break
-        last_item_key = response.last
-    return all_herbs
+    return fetch_all(inventory_db, page_size)
 
 # print(fetch_all_herbs())
 
 
 
+@metrics.timed
 def get_herb(herb_id):
     """If not found, the function will return None"""
-    return inventory_db.get(herb_id)
+    return get_item("inventory", herb_id)
 
 # print(get_herb("h13"))
 
 
+@metrics.timed
 def update_herb(herb_id, updates):
     """If the item is updated, returns None. Otherwise, an exception is raised"""
     # updates = {
     #     "unit_price":new_unit_price,
     #     "inventory":new_inventory,
     # }
-    return inventory_db.update(updates, herb_id)
+    return inventory_db.update(stamp(updates), herb_id)
 
 # print(update_herb("h01", {"inventory":99}))
 
 
+@metrics.timed
 def delete_herb(herb_id):
     """Always returns None, even if the key does not exist"""
-    return inventory_db.delete(herb_id)
+    return delete_item("inventory", herb_id)
 
 # print(delete_herb("h14"))
 
@@ -100,137 +328,187 @@ def delete_herb(herb_id):
 
 # ---- 2. income_db ----
 
+@metrics.timed
 def insert_income(income_id, date, category, item, customer, amount):
     """Returns the item on a successful income creation, otherwise raises and error"""
     return income_db.put(
-        {
+        stamp({
             "key": income_id,
             "date": date,
+            "period": mark_period("income", date),
             "category": category,
             "item": item,
             "customer": customer,
             "amount": amount,
-        }
+        })
     )
 
 
 # print(insert_income("C00036", "28-Aug-23", "診症", "Tim", "///", 111))
 
 
-def fetch_all_incomes():
+@metrics.timed
+def insert_incomes(rows):
+    """Bulk version of insert_income for rows of {"key", "date", "category", "item", "customer", "amount"}.
+    Rows without a key get one from the database. Returns (stored items, failed batches), see put_many"""
+    return put_many(income_db, [
+        stamp({**row, "period": mark_period("income", row["date"])}) for row in rows
+    ])
+
+
+@metrics.timed
+def fetch_all_incomes(page_size=None):
     """Returns a dict of all incomes"""
-    all_incomes = []
-    last_item_key = None
-    while True:
-        response = income_db.fetch(limit=100, last=last_item_key)
-        all_incomes.extend(response.items)
-        if not response.last:
-            break
-        last_item_key = response.last
-    return all_incomes
+    return fetch_all(income_db, page_size)
 
 # print(fetch_all_incomes())
 
 
+@metrics.timed
 def get_income(time):
     """If not found, the function will return None"""
-    return income_db.get(time)
+    return get_item("income", time)
 
 # print(get_income("2023-08-16-08:00"))
 
 
+@metrics.timed
 def update_income(time, updates):
     """If the item is updated, returns None. Otherwise, an exception is raised"""
     # updates = {}
-    return income_db.update(updates, time)
+    return update_item("income", time, updates) # keeps "period" and periods_db in step with "date"
 
 # print(update_income("2023-08-16-08:02:00", {"amount": 195}))
 
 
+@metrics.timed
 def delete_income(time):
     """Always returns None, even if the key does not exist"""
-    return income_db.delete(time)
+    return delete_item("income", time) # drops the month from periods_db if this was its last row
 
 # print(delete_income("2023-08-16-08:00"))
 
 
 # ---- 3. expense_db ----
 
+@metrics.timed
 def insert_expense(expense_id, date, category, item, amount):
     """Returns the item on a successful income creation, otherwise raises and error"""
     return expense_db.put(
-        {
+        stamp({
             "key": expense_id,
             "date": date,
+            "period": mark_period("expense", date),
             "category": category,
             "item": item,
             "amount": amount,
-        }
+        })
     )
 
 
 # print(insert_expense("2023-08-16-09:09", "Utilities", "Electricities of August", 100))
 
 
-def fetch_all_expenses():
+@metrics.timed
+def insert_expenses(rows):
+    """Bulk version of insert_expense for rows of {"key", "date", "category", "item", "amount"}.
+    Rows without a key get one from the database. Returns (stored items, failed batches), see put_many"""
+    return put_many(expense_db, [
+        stamp({**row, "period": mark_period("expense", row["date"])}) for row in rows
+    ])
+
+
+@metrics.timed
+def fetch_all_expenses(page_size=None):
     """Returns a dict of all expenses"""
-    all_expenses = []
-    last_item_key = None
-    while True:
-        response = expense_db.fetch(limit=100, last=last_item_key)
-        all_expenses.extend(response.items)
-        if not response.last:
-            break
-        last_item_key = response.last
-    return all_expenses
+    return fetch_all(expense_db, page_size)
 
 # print(fetch_all_expenses())
 
 
+@metrics.timed
 def get_expense(time):
     """If not found, the function will return None"""
-    return expense_db.get(time)
+    return get_item("expense", time)
 
 # print(get_expense("2023-08-16-08:04"))
 
 
+@metrics.timed
 def update_expense(time, updates):
     """If the item is updated, returns None. Otherwise, an exception is raised"""
     # updates = {}
-    return expense_db.update(updates, time)
+    return update_item("expense", time, updates) # keeps "period" and periods_db in step with "date"
 
 # print(update_expense("2023-08-16-08:03", {"amount":199}))
 
 
+@metrics.timed
 def delete_expense(time):
     """Always returns None, even if the key does not exist"""
-    return expense_db.delete(time)
+    return delete_item("expense", time) # drops the month from periods_db if this was its last row
 
 # print(delete_expense("2023-08-16-08:02"))
 
 
 # ---- 4. users_db ----
+# app.py needs the users on every rerun, so this process keeps a copy for USERS_TTL_SECONDS.
+# insert_user / update_user / delete_user drop it at once; other processes see their
+# changes when the copy expires.
+users_directory = {"users": None, "loaded_at": None, "version": 0}
+users_lock = threading.Lock()
+
+
+@metrics.timed
+def users_snapshot():
+    """Returns (version, list of all users). The version changes whenever the list does"""
+    with users_lock:
+        now = time.time()
+        if users_directory["users"] is None or now - users_directory["loaded_at"] > USERS_TTL_SECONDS:
+            users = fetch_all_users()
+            if users != users_directory["users"]:
+                users_directory["users"] = users
+                users_directory["version"] += 1
+            users_directory["loaded_at"] = now
+        return users_directory["version"], users_directory["users"]
+
+
+def invalidate_users():
+    with users_lock:
+        users_directory["users"] = None
+
+
+@metrics.timed
 def insert_user(username, name, password):
     """Returns the user on a successful user creation, otherwise raises and error"""
-    return users_db.put({"key": username, "name": name, "password": password})
+    user = users_db.put({"key": username, "name": name, "password": password})
+    invalidate_users()
+    return user
 
 
+@metrics.timed
 def fetch_all_users():
-    """Returns a dict of all users"""
-    res = users_db.fetch()
-    return res.items
+    """Returns a list of all users, walking users_db page by page"""
+    return fetch_all(users_db)
 
 
+@metrics.timed
 def get_user(username):
     """If not found, the function will return None"""
     return users_db.get(username)
 
 
+@metrics.timed
 def update_user(username, updates):
     """If the item is updated, returns None. Otherwise, an exception is raised"""
-    return users_db.update(updates, username)
+    result = users_db.update(updates, username)
+    invalidate_users()
+    return result
 
 
+@metrics.timed
 def delete_user(username):
     """Always returns None, even if the key does not exist"""
-    return users_db.delete(username)
\ No newline at end of file
+    result = users_db.delete(username)
+    invalidate_users()
+    return result
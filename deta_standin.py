@@ -0,0 +1,102 @@
+import json
+import re
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+from backends import SqliteBackend
+
+# A local stand-in for the Deta Base HTTP API, kept in a SQLite file, for trying the
+# deta backend (and its connection pool) without a Deta project:
+#   python deta_standin.py [port] [sqlite path]
+#   STORAGE_BACKEND=deta DETA_KEY=local_key DETA_BASE_URL=http://127.0.0.1:8765/v1 streamlit run app.py
+# tests/test_backends.py runs backends.DetaBackend against it.
+# Only the calls backends.DetaTable makes are served; the API key is not checked.
+
+DEFAULT_PORT = 8765
+DEFAULT_PATH = "./data/deta_standin.db"
+
+ITEMS_PATH = re.compile(r"^/v1/[^/]+/([^/]+)/items(?:/(.+))?$")
+QUERY_PATH = re.compile(r"^/v1/[^/]+/([^/]+)/query$")
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like database.deta.sh
+    backend = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body=None):
+        data = json.dumps(body, ensure_ascii=False).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def route(self):
+        """Returns (table, key) for /items paths, (table, None) for /query, or None"""
+        match = ITEMS_PATH.match(self.path) or QUERY_PATH.match(self.path)
+        if match is None:
+            return None
+        key = match.group(2) if match.re is ITEMS_PATH else None
+        return self.backend.table(match.group(1)), unquote(key) if key else None
+
+    def handle_request(self, method):
+        route = self.route()
+        if route is None:
+            return self.reply(404, {"errors": ["Not found"]})
+        table, key = route
+        if method == "PUT":
+            return self.reply(207, {"processed": table.put_many(self.body()["items"])["processed"], "failed": {"items": []}})
+        if method == "GET":
+            item = table.get(key)
+            return self.reply(200, item) if item is not None else self.reply(404, {"key": key})
+        if method == "PATCH":
+            try:
+                table.update(self.body().get("set", {}), key)
+            except Exception:
+                return self.reply(404, {"errors": ["Key not found"]})
+            return self.reply(200, {"key": key})
+        if method == "DELETE":
+            table.delete(key)
+            return self.reply(200, {"key": key})
+        body = self.body()
+        page = table.fetch(body.get("query"), limit=body.get("limit", 1000), last=body.get("last"))
+        return self.reply(200, {"paging": {"size": page.count, "last": page.last}, "items": page.items})
+
+    def do_PUT(self):
+        self.handle_request("PUT")
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_PATCH(self):
+        self.handle_request("PATCH")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+
+def make_server(port=DEFAULT_PORT, path=DEFAULT_PATH):
+    """Returns the server, not started yet; port 0 picks a free one (see server.server_port)"""
+    Handler.backend = SqliteBackend(path)
+    return ThreadingHTTPServer(("127.0.0.1", port), Handler)
+
+
+def serve(port=DEFAULT_PORT, path=DEFAULT_PATH):
+    server = make_server(port, path)
+    print(f"Deta stand-in on http://127.0.0.1:{server.server_port}/v1 (data in {path})")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    serve(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PORT, sys.argv[2] if len(sys.argv) > 2 else DEFAULT_PATH)
@@ -0,0 +1,41 @@
+import math
+
+# Turns the edit state of st.data_editor into the changes to write to the database.
+# Only the cells the editor reports as edited are read, so the cost grows with the
+# number of edits rather than with the size of the table.
+
+
+def same_value(old_value, new_value):
+    """True if an edited cell holds what it held before (numbers compared as floats, empty == NaN)"""
+    if old_value is None or (isinstance(old_value, float) and math.isnan(old_value)):
+        return new_value is None or (isinstance(new_value, float) and math.isnan(new_value))
+    if new_value is None:
+        return False
+    if isinstance(new_value, float):
+        try:
+            return float(old_value) == new_value
+        except (TypeError, ValueError):
+            return False
+    return old_value == new_value
+
+
+def diff_edits(df, edited_rows, key_column="key"):
+    """Returns {key: {column: new value}} for the cells in `edited_rows` whose value really changed.
+    `edited_rows` is the data editor's {row position in df: {column: value}}; numbers come back
+    as floats, text as str, a cleared cell as None. Rows left with no change are dropped."""
+    key_position = df.columns.get_loc(key_column)
+    column_positions = {}
+    changes = {}
+    for position, row_changes in edited_rows.items():
+        position = int(position)
+        updates = {}
+        for column, new_value in row_changes.items():
+            if column not in column_positions:
+                column_positions[column] = df.columns.get_loc(column)
+            if not (new_value is None or isinstance(new_value, str)):
+                new_value = float(new_value)
+            if not same_value(df.iat[position, column_positions[column]], new_value):
+                updates[column] = new_value
+        if updates:
+            changes[df.iat[position, key_position]] = updates
+    return changes
@@ -1,22 +1,31 @@
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib import font_manager
-import asyncio
 from datetime import datetime
 import utils
-import time
-import io
-import base64
 
 import database as db
+import data_access
+import table_view
+import exports
+import bulk_import
+import mutations
+import profiling
+import charts
 import columns_categories_config as ccconfig
 
-@st.cache_data
-def fetch_all_expenses_cached():
+@st.cache_data(ttl=data_access.SYNC_INTERVAL_SECONDS, max_entries=20)
+def load_expenses(version, periods, categories):
     try:
-        data = db.fetch_all_expenses()
-        return data
+        return data_access.query("expense", list(periods), list(categories)) # only the chosen months and categories are read
+    except Exception as e:
+        st.error(f"讀取支出數據時發生錯誤：{e}")
+        return utils.add_month_columns(pd.DataFrame(columns=ccconfig.EXPENSE_COLUMN_ORDER))
+
+
+@st.cache_data(ttl=data_access.SYNC_INTERVAL_SECONDS, max_entries=20)
+def load_month_options(version):
+    try:
+        return data_access.month_options("expense")
     except Exception as e:
         st.error(f"讀取支出數據時發生錯誤：{e}")
         return []
@@ -24,68 +33,78 @@ def fetch_all_expenses_cached():
 
 def add_expense_item(expense_id, date, category, item, amount):
     parsed_date = datetime.strptime(str(date), "%Y-%m-%d")
-    formatted_date = parsed_date.strftime("%d-%b-%y")
-
-    async def add_expense_item_async(expense_id, formatted_date, category, item, amount):
-        try:
-            db.insert_expense(expense_id, formatted_date, category, item, amount)
-        except Exception as e:
-            st.error(f"An error occurred: {e}")
-        finally:
-            st.cache_data.clear()
-
-    coro = add_expense_item_async(expense_id, formatted_date, category, item, amount)
-
-    with st.spinner("正在加入支出項目..."):
-        asyncio.run(coro)
-
-    st.success(ccconfig.SUCCESS_MSG)
-    time.sleep(1)
-    st.experimental_rerun()
+    formatted_date = parsed_date.strftime(utils.DATE_FORMAT)
+    expense_id = expense_id or db.new_key()
+    new_item = {
+        "key": expense_id,
+        "date": formatted_date,
+        "period": utils.date_period(formatted_date),
+        "category": category,
+        "item": item,
+        "amount": amount,
+    }
+    mutations.put(
+        "expense", new_item,
+        description=f"新增支出編號 {expense_id}",
+    )
     
 
 def remove_expense(expense_id):
-    async def remove_expense_async(expense_id):
-        try:
-            db.delete_expense(expense_id)
-        except Exception as e:
-            st.error(f"An error occurred: {e}")
-        finally:
-            st.cache_data.clear()
-
-    coro = remove_expense_async(expense_id)
-
-    with st.spinner("正在移除支出項目..."):
-        asyncio.run(coro)
-
-    st.success(ccconfig.SUCCESS_MSG)
-    time.sleep(1)
-    st.experimental_rerun()
+    mutations.delete(
+        "expense", expense_id,
+        description=f"移除支出編號 {expense_id}",
+    )
+
+
+def add_expense_clicked():
+    state = st.session_state
+    fields = [state["expense_date"], state["expense_category"], state["expense_item"], state["expense_amount"]]
+    if any(field == "" for field in fields):
+        mutations.notify("warning", ccconfig.WARNING_MSG_FILL_ALL)
+    else:
+        add_expense_item(state["expense_id"], *fields)
+
+
+def remove_expense_clicked():
+    chosen_expense_id = st.session_state["expense_remove_id"]
+    if chosen_expense_id:
+        if data_access.exists("expense", chosen_expense_id):
+            remove_expense(chosen_expense_id)
+        else:
+            mutations.notify("warning", "此支出編號不存在。")
+    else:
+        mutations.notify("warning", "請選擇支出編號。")
 
 
 def expense():
+    profiling.stage("form")
+    mutations.show_status() # messages from the buttons below and from background writes
+
     # Add expense form
     st.header("新增支出項目")
     CATEGORIES = ccconfig.EXPENSE_CATEGORIES # ["Rent", "Salaries", "Utilities", "Advertising", "Travel", "Others"]
-    COLUMN_ORDER = ccconfig.EXPENSE_COLUMN_ORDER # ["key", "category", "item", "amount"] 
-    expense_id = st.text_input("編號")
-    date = st.date_input("日期")
-    category = st.selectbox("會計項目", CATEGORIES)
-    item = st.text_input("內容")
-    amount = st.number_input("金額", step=1, min_value=0)
-    if st.button("新增支出項目"):
-        if any(field == "" for field in [date, category, item, amount]):
-            st.warning(ccconfig.WARNING_MSG_FILL_ALL)
-        else:
-            add_expense_item(expense_id, date, category, item, amount)
+    column_titles = {
+        "key": "支出編號",
+        "date": "日期",
+        "category": "會計項目",
+        "item": "內容",
+        "amount": "金額"
+    }
+    st.text_input("編號", key="expense_id")
+    st.date_input("日期", key="expense_date")
+    st.selectbox("會計項目", CATEGORIES, key="expense_category")
+    st.text_input("內容", key="expense_item")
+    st.number_input("金額", step=1, min_value=0, key="expense_amount")
+    st.button("新增支出項目", on_click=add_expense_clicked) # runs before the page is drawn again
+
+    with st.expander("從CSV或Excel文件匯入支出項目"):
+        bulk_import.import_section("expense", column_titles)
 
 
 
     st.divider()
-    expense_data = fetch_all_expenses_cached()
-    df_expense = pd.DataFrame(expense_data, columns=COLUMN_ORDER) # initialize dataframe with the expected column order
-    df_expense['month'] = df_expense['date'].apply(utils.format_month) # add a new column "month", by reading the "date" column
-    month_options = df_expense['month'].unique() # list of months, e.g. ['2023 May' '2023 Jun' '2023 Jul' '2023 Aug']
+    profiling.stage("month options")
+    month_options = load_month_options(data_access.version("expense")) # list of periods, oldest first, shown as e.g. ['2023 May' '2023 Jun' '2023 Jul' '2023 Aug']
     
      
     # Display all expenses and delete button in 2 columns (2:1)
@@ -97,21 +116,19 @@ def expense():
         selected_month = st.multiselect(
             "按月份篩選",
             options=month_options,
-            default=month_options[-1] if len(month_options) > 0 else month_options, # default to choose only the latest month
+            default=month_options[-1:], # default to choose only the latest month
+            format_func=utils.month_label,
         )
         selected_categories = st.multiselect(
             "按類別篩選",
             options=CATEGORIES,
             default=CATEGORIES,
         )
-        filtered_df_expense = df_expense[
-            (df_expense['category'].isin(selected_categories)) &
-            (df_expense['month'].isin(selected_month))
-        ]
-        filtered_df_expense = filtered_df_expense.drop(columns=['month'])  # Drop the 'month' column
-        st.dataframe(filtered_df_expense, 
-                     hide_index=True, 
-                     use_container_width=True,
+        profiling.stage("rows")
+        filtered_df_expense = load_expenses(data_access.version("expense"), tuple(selected_month), tuple(selected_categories))
+        table_view.paginated_dataframe(filtered_df_expense, 
+                     key="expense_table",
+                     sort_keys={"date": "date_value"}, # sort by the parsed date, not the text
                      column_config={
                         "key": st.column_config.Column("支出編號", disabled=True, help=ccconfig.INFO_MSG_NOT_EDITABLE),
                         "date": st.column_config.TextColumn("日期"),
@@ -120,73 +137,39 @@ def expense():
                         "amount": st.column_config.NumberColumn("金額", format="$%d"),
                      }
         )
+        filtered_df_expense = filtered_df_expense.drop(columns=utils.MONTH_COLUMNS)  # Drop the columns derived from "date"
 
 
-    # Export excel file
-    column_titles = {
-        "key": "支出編號",
-        "date": "日期",
-        "category": "會計項目",
-        "item": "內容",
-        "amount": "金額"
-    }
-    excel_export_df = filtered_df_expense.rename(columns=column_titles)
-    excel_buffer = io.BytesIO()
-
-    with pd.ExcelWriter(excel_buffer, engine="xlsxwriter") as writer:
-        excel_export_df.to_excel(writer, sheet_name="支出報告", index=False)
-
-    b64 = base64.b64encode(excel_buffer.getvalue()).decode()
-    href = f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="expense_data.xlsx" class="button">下載Excel支出報告</a>'
-    st.markdown(href, unsafe_allow_html=True)
+    # Export excel file (built only when asked for)
+    exports.download_button(
+        "Excel支出報告", "expense_data.xlsx", exports.XLSX_MIME,
+        build=lambda: exports.build_xlsx({"支出報告": filtered_df_expense.rename(columns=column_titles)}),
+        key="expense_xlsx",
+        signature=(exports.data_signature(filtered_df_expense), tuple(selected_month), tuple(selected_categories)),
+    )
 
 
     with col2:
         st.subheader("移除支出項目：")
-        expense_id_list = df_expense["key"].tolist()
-        chosen_expense_id = st.text_input("輸入支出編號移除：")
+        st.text_input("輸入支出編號移除：", key="expense_remove_id")
         with st.expander("確認移除支出項目", expanded=False):
-            delete_button = st.button("確認", type="primary")
-
-        if delete_button:
-            if chosen_expense_id:
-                if chosen_expense_id in expense_id_list:
-                    remove_expense(chosen_expense_id)
-                    st.success(f"已移除支出編號：{chosen_expense_id}，現在現在刷新頁面...")
-                    time.sleep(1)
-                    st.experimental_rerun()
-                else:
-                    st.warning("此支出編號不存在。")
-            else:
-                st.warning("請選擇支出編號。")
+            st.button("確認", type="primary", on_click=remove_expense_clicked)
 
 
     # Show pie chart and table in 2 columns
     st.divider()
     col1, col2 = st.columns([2,1])
     with col1:
+        profiling.stage("pie chart")
         st.subheader("支出分佈")
         expense_by_category = filtered_df_expense.groupby("category")["amount"].sum()
-        # Set Chinese font
-        fontP = font_manager.FontProperties(fname="./fonts/SimHei.ttf")
-        fontP.set_family('SimHei') 
-        fontP.set_size(14)
-
-        fig, ax = plt.subplots(figsize=(8, 6))
-        wedges, texts, autotexts = ax.pie(
-            expense_by_category,
-            labels=[f"{label} (${value:.2f})" for label, value in expense_by_category.items()],
-            autopct="%1.1f%%",
-        )
-        ax.set_title(f"支出類別", fontproperties=fontP)
-        for text in texts:
-            text.set_fontproperties(fontP)
-        plt.setp(autotexts, size=10, weight="bold")
-        st.pyplot(fig)
+        chart = charts.pie_chart("支出類別", tuple(expense_by_category.items())) # drawn again only when the amounts change
+        st.image(chart, use_column_width=True)
 
     with col2:
+        profiling.stage("totals")
         total_expense = expense_by_category.sum()
-        selected_month_str = ", ".join(selected_month)
+        selected_month_str = ", ".join(utils.month_label(period) for period in selected_month)
         st.subheader("總支出")
         st.write(f"時限：{selected_month_str}")
 
@@ -0,0 +1,160 @@
+import hashlib
+import io
+import itertools
+import threading
+from collections import OrderedDict
+from xml.sax.saxutils import escape
+
+import pandas as pd
+import streamlit as st
+import xlsxwriter  # pip install XlsxWriter
+from docx.enum.style import WD_STYLE_TYPE
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls, qn
+
+import profiling
+import columns_categories_config as ccconfig
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+
+def build_xlsx(sheets):
+    """Returns the bytes of an xlsx file with one sheet per {sheet name: DataFrame}.
+    Rows are written in order with XlsxWriter's constant_memory mode, which flushes each
+    finished row to a temporary file instead of keeping the whole sheet in memory."""
+    buffer = io.BytesIO()
+    workbook = xlsxwriter.Workbook(buffer, {"constant_memory": True})
+    for sheet_name, df in sheets.items():
+        worksheet = workbook.add_worksheet(sheet_name)
+        worksheet.write_row(0, 0, [str(column) for column in df.columns])
+        for row_number, row in enumerate(df.itertuples(index=False, name=None), start=1):
+            worksheet.write_row(row_number, 0, [None if pd.isna(value) else value for value in row])
+    workbook.close()
+    return buffer.getvalue()
+
+
+CENTERED_STYLE = "Table Centered" # paragraph style shared by every cell of the tables below
+DOCX_PARSE_ROWS = 1000 # table rows written and parsed per XML fragment in add_table
+
+
+def centered_style(doc):
+    """Returns the centred paragraph style used in table cells, adding it to the document once"""
+    try:
+        return doc.styles[CENTERED_STYLE]
+    except KeyError:
+        style = doc.styles.add_style(CENTERED_STYLE, WD_STYLE_TYPE.PARAGRAPH)
+        style.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        return style
+
+
+def add_table(doc, df, style="Table Grid"):
+    """Appends `df` to a python-docx Document as a table with a header row, all cells centred.
+    Only the header goes through python-docx; the data rows are written as XML fragments of
+    DOCX_PARSE_ROWS rows, each parsed in one go, instead of table.cell(i, j) walking the table
+    for every cell. Fragments stay far below libxml2's 10 MB limit on a single parse."""
+    table = doc.add_table(rows=1, cols=df.shape[1])
+    table.style = style
+    paragraph_style = centered_style(doc)
+    for cell, column in zip(table.rows[0].cells, df.columns):
+        cell.text = str(column)
+        cell.paragraphs[0].style = paragraph_style
+
+    # Every cell of a column repeats the header cell's width. Written out by hand: serializing
+    # the header's tcPr would repeat every namespace python-docx declares in each cell
+    cell_properties = []
+    for cell in table.rows[0].cells:
+        width = cell._tc.tcPr.tcW
+        cell_properties.append(f'<w:tcPr><w:tcW w:w="{width.get(qn("w:w"))}" w:type="{width.get(qn("w:type"))}"/></w:tcPr>')
+    paragraph_properties = f'<w:pPr><w:pStyle w:val="{paragraph_style.style_id}"/></w:pPr>'
+    rows = df.itertuples(index=False, name=None)
+    while True:
+        rows_xml = []
+        for row in itertools.islice(rows, DOCX_PARSE_ROWS):
+            cells_xml = "".join(
+                f'<w:tc>{properties}<w:p>{paragraph_properties}<w:r><w:t xml:space="preserve">{escape(str(value))}</w:t></w:r></w:p></w:tc>'
+                for properties, value in zip(cell_properties, row)
+            )
+            rows_xml.append(f"<w:tr>{cells_xml}</w:tr>")
+        if not rows_xml:
+            return table
+        fragment = parse_xml(f'<w:tbl {nsdecls("w")}>{"".join(rows_xml)}</w:tbl>')
+        for row_element in list(fragment):
+            table._tbl.append(row_element)
+
+
+def build_docx(doc):
+    """Returns the bytes of a python-docx Document"""
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+class ExportCache:
+    """Generated files shared by every session of this process, keyed by a hash of what they
+    were built from. The least recently used files are dropped once they add up to more than
+    `max_bytes`."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.files = OrderedDict()  # digest -> bytes, least recently used first
+        self.size = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def digest(report, signature):
+        """`report` names the file, e.g. "inventory_docx"; `signature` holds data_signature()
+        of the frames it was built from, plus any option that changes the file (e.g. sort order)"""
+        return hashlib.sha256(repr((report, signature)).encode()).hexdigest()
+
+    def get(self, digest):
+        with self.lock:
+            data = self.files.get(digest)
+            if data is not None:
+                self.files.move_to_end(digest)
+            return data
+
+    def put(self, digest, data):
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            old_data = self.files.pop(digest, None)
+            if old_data is not None:
+                self.size -= len(old_data)
+            self.files[digest] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self.files.popitem(last=False)
+                self.size -= len(evicted)
+
+
+export_cache = ExportCache(ccconfig.EXPORT_CACHE_MAX_BYTES)
+
+
+def data_signature(*dfs):
+    """Describes the data of each frame. A frame from data_access.frame or data_access.query carries
+    the table version it was read at, and when it was read from the database (see data_access.stamped),
+    so no row is looked at and rows another process wrote still give a new signature; the caller adds
+    the filters it applied to it. Any other frame (e.g. the small statistics tables) is hashed"""
+    return tuple(
+        (len(df), df.attrs["source"]) if "source" in df.attrs else (len(df), int(pd.util.hash_pandas_object(df).sum()))
+        for df in dfs
+    )
+
+
+def download_button(label, file_name, mime, build, key, signature):
+    """Shows a button that builds the file with build() only when clicked, then a
+    st.download_button for it. `label` names the report, e.g. "Excel收入報告".
+    `signature` describes the data the file was built from (see data_signature, plus options).
+    Built files go to export_cache, so as long as the signature is unchanged the file is
+    offered straight away, on later reruns and in other sessions too."""
+    digest = export_cache.digest(key, signature)
+    data = export_cache.get(digest)
+    if data is None:
+        if st.button(f"準備{label}", key=f"{key}_prepare"):
+            with st.spinner("正在準備文件..."), profiling.span(f"build {file_name}"):
+                data = build()
+            export_cache.put(digest, data)
+    if data is not None:
+        st.download_button(f"下載{label}", data=data, file_name=file_name, mime=mime, key=f"{key}_download")
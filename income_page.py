@@ -1,22 +1,31 @@
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib import font_manager
-import asyncio
 from datetime import datetime
 import utils
-import time
-import io
-import base64
 
 import database as db
+import data_access
+import table_view
+import exports
+import bulk_import
+import mutations
+import profiling
+import charts
 import columns_categories_config as ccconfig
 
-@st.cache_data
-def fetch_all_incomes_cached():
+@st.cache_data(ttl=data_access.SYNC_INTERVAL_SECONDS, max_entries=20)
+def load_incomes(version, periods, categories):
     try:
-        data = db.fetch_all_incomes()
-        return data
+        return data_access.query("income", list(periods), list(categories)) # only the chosen months and categories are read
+    except Exception as e:
+        st.error(f"讀取收入數據時發生錯誤：{e}")
+        return utils.add_month_columns(pd.DataFrame(columns=ccconfig.INCOME_COLUMN_ORDER))
+
+
+@st.cache_data(ttl=data_access.SYNC_INTERVAL_SECONDS, max_entries=20)
+def load_month_options(version):
+    try:
+        return data_access.month_options("income")
     except Exception as e:
         st.error(f"讀取收入數據時發生錯誤：{e}")
         return []
@@ -24,68 +33,80 @@ def fetch_all_incomes_cached():
 
 def add_income_item(income_id, date, category, item, customer, amount):
     parsed_date = datetime.strptime(str(date), "%Y-%m-%d")
-    formatted_date = parsed_date.strftime("%d-%b-%y")
-
-    async def add_income_item_async(income_id, formatted_date, category, item, customer, amount):
-        try:
-            db.insert_income(income_id, formatted_date, category, item, customer, amount)
-        except Exception as e:
-            print(f"Error occurred: {e}")
-        finally:
-            st.cache_data.clear()
-
-    coro = add_income_item_async(income_id, formatted_date, category, item, customer, amount)
-
-    with st.spinner("正在加入收入項目..."):
-        asyncio.run(coro)
-
-    st.success(ccconfig.SUCCESS_MSG)
-    time.sleep(1)
-    st.experimental_rerun()
+    formatted_date = parsed_date.strftime(utils.DATE_FORMAT)
+    income_id = income_id or db.new_key()
+    new_item = {
+        "key": income_id,
+        "date": formatted_date,
+        "period": utils.date_period(formatted_date),
+        "category": category,
+        "item": item,
+        "customer": customer,
+        "amount": amount,
+    }
+    mutations.put(
+        "income", new_item,
+        description=f"新增收入編號 {income_id}",
+    )
 
 
 def remove_income(income_id):
-    async def remove_income_async(income_id):
-        try:
-            db.delete_income(income_id)
-        except Exception as e:
-            st.error(f"An error occurred: {e}")
-        finally:
-            st.cache_data.clear()
-
-    coro = remove_income_async(income_id)
-
-    with st.spinner("正在移除收入項目..."):
-        asyncio.run(coro)
-
-    st.success(ccconfig.SUCCESS_MSG)
-    time.sleep(1)
-    st.experimental_rerun()
+    mutations.delete(
+        "income", income_id,
+        description=f"移除收入編號 {income_id}",
+    )
+
+
+def add_income_clicked():
+    state = st.session_state
+    fields = [state["income_date"], state["income_category"], state["income_item"], state["income_customer"], state["income_amount"]]
+    if any(field == "" for field in fields):
+        mutations.notify("warning", ccconfig.WARNING_MSG_FILL_ALL)
+    else:
+        add_income_item(state["income_id"], *fields)
+
+
+def remove_income_clicked():
+    chosen_income_id = st.session_state["income_remove_id"]
+    if chosen_income_id:
+        if data_access.exists("income", chosen_income_id):
+            remove_income(chosen_income_id)
+        else:
+            mutations.notify("warning", "此收入編號不存在。")
+    else:
+        mutations.notify("warning", "請選擇收入編號。")
 
 
 def income():
+    profiling.stage("form")
+    mutations.show_status() # messages from the buttons below and from background writes
+
     # Add income form
     st.header("新增收入項目")
     CATEGORIES = ccconfig.INCOME_CATEGORIES # ["Consultation", "Herb Sale", "Class", "Others"]
-    COLUMN_ORDER = ccconfig.INCOME_COLUMN_ORDER # ["key", "category", "item", "customer", "amount"]
-    income_id = st.text_input("編號")
-    date = st.date_input("日期")
-    category = st.selectbox("會計項目", CATEGORIES)
-    item = st.text_input("內容")
-    customer = st.text_input("客戶名稱")
-    amount = st.number_input("金額", step=1, min_value=0)
-    if st.button("新增收入項目"):
-        if any(field == "" for field in [date, category, item, customer, amount]):
-            st.warning(ccconfig.WARNING_MSG_FILL_ALL)
-        else:
-            add_income_item(income_id, date, category, item, customer, amount)
+    column_titles = {
+        "key": "收入編號",
+        "date": "日期",
+        "category": "會計項目",
+        "item": "內容",
+        "customer": "客戶名稱",
+        "amount": "金額"
+    }
+    st.text_input("編號", key="income_id")
+    st.date_input("日期", key="income_date")
+    st.selectbox("會計項目", CATEGORIES, key="income_category")
+    st.text_input("內容", key="income_item")
+    st.text_input("客戶名稱", key="income_customer")
+    st.number_input("金額", step=1, min_value=0, key="income_amount")
+    st.button("新增收入項目", on_click=add_income_clicked) # runs before the page is drawn again
+
+    with st.expander("從CSV或Excel文件匯入收入項目"):
+        bulk_import.import_section("income", column_titles)
 
 
     st.divider()
-    income_data = fetch_all_incomes_cached()
-    df_income = pd.DataFrame(income_data, columns=COLUMN_ORDER) # initialize dataframe with the expected column order
-    df_income['month'] = df_income['date'].apply(utils.format_month) # add a new column "month", by reading the "date" column
-    month_options = df_income['month'].unique() # list of months, e.g. ['2023 May' '2023 Jun' '2023 Jul' '2023 Aug']
+    profiling.stage("month options")
+    month_options = load_month_options(data_access.version("income")) # list of periods, oldest first, shown as e.g. ['2023 May' '2023 Jun' '2023 Jul' '2023 Aug']
 
 
     # Display all incomes and delete button in 2 columns (2:1)
@@ -97,21 +118,19 @@ def income():
         selected_month = st.multiselect(
             "按月份篩選",
             options=month_options,
-            default=month_options[-1] if len(month_options) > 0 else month_options, # default to choose only the latest month
+            default=month_options[-1:], # default to choose only the latest month
+            format_func=utils.month_label,
         )
         selected_categories = st.multiselect(
             "按類別篩選",
             options=CATEGORIES,
             default=CATEGORIES,
         )
-        filtered_df_income = df_income[
-            (df_income['category'].isin(selected_categories)) &
-            (df_income['month'].isin(selected_month))
-        ]
-        filtered_df_income = filtered_df_income.drop(columns=['month'])  # Drop the 'month' column
-        st.dataframe(filtered_df_income, 
-                     hide_index=True, 
-                     use_container_width=True,
+        profiling.stage("rows")
+        filtered_df_income = load_incomes(data_access.version("income"), tuple(selected_month), tuple(selected_categories))
+        table_view.paginated_dataframe(filtered_df_income, 
+                     key="income_table",
+                     sort_keys={"date": "date_value"}, # sort by the parsed date, not the text
                      column_config={
                         "key": st.column_config.Column("收入編號", disabled=True, help=ccconfig.INFO_MSG_NOT_EDITABLE),
                         "date": st.column_config.TextColumn("日期"),
@@ -121,74 +140,39 @@ def income():
                         "amount": st.column_config.NumberColumn("金額", format="$%d"),
                      }
         )
+        filtered_df_income = filtered_df_income.drop(columns=utils.MONTH_COLUMNS)  # Drop the columns derived from "date"
 
-    # Export excel file
-    column_titles = {
-        "key": "收入編號",
-        "date": "日期",
-        "category": "會計項目",
-        "item": "內容",
-        "customer": "客戶名稱",
-        "amount": "金額"
-    }
-    excel_export_df = filtered_df_income.rename(columns=column_titles)
-    excel_buffer = io.BytesIO()
-
-    with pd.ExcelWriter(excel_buffer, engine="xlsxwriter") as writer:
-        excel_export_df.to_excel(writer, sheet_name="收入報告", index=False)
-
-    b64 = base64.b64encode(excel_buffer.getvalue()).decode()
-    href = f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="income_data.xlsx" class="button">下載Excel收入報告</a>'
-    st.markdown(href, unsafe_allow_html=True)
+    # Export excel file (built only when asked for)
+    exports.download_button(
+        "Excel收入報告", "income_data.xlsx", exports.XLSX_MIME,
+        build=lambda: exports.build_xlsx({"收入報告": filtered_df_income.rename(columns=column_titles)}),
+        key="income_xlsx",
+        signature=(exports.data_signature(filtered_df_income), tuple(selected_month), tuple(selected_categories)),
+    )
 
 
 
     with col2:
         st.subheader("移除收入項目：")
-        income_id_list = df_income["key"].tolist()
-        chosen_income_id = st.text_input("輸入收入編號移除：")
+        st.text_input("輸入收入編號移除：", key="income_remove_id")
         with st.expander("確認移除收入項目", expanded=False):
-            delete_button = st.button("確認", type="primary")
-
-        if delete_button:
-            if chosen_income_id:
-                if chosen_income_id in income_id_list:
-                    remove_income(chosen_income_id)
-                    st.success(f"已移除收入編號： {chosen_income_id}，現在現在刷新頁面...")
-                    time.sleep(1)
-                    st.experimental_rerun()
-                else:
-                    st.warning("此收入編號不存在。")
-            else:
-                st.warning("請選擇收入編號。")
+            st.button("確認", type="primary", on_click=remove_income_clicked)
 
 
     # Show pie chart and table in 2 columns
     st.divider()
     col1, col2 = st.columns([2,1])
     with col1:
+        profiling.stage("pie chart")
         st.subheader("收入分佈")
         income_by_category = filtered_df_income.groupby("category")["amount"].sum()
-        # Set Chinese font
-        fontP = font_manager.FontProperties(fname="./fonts/SimHei.ttf")
-        fontP.set_family('SimHei') 
-        fontP.set_size(14)
-
-        fig, ax = plt.subplots(figsize=(8, 6))
-        wedges, texts, autotexts = ax.pie(
-            income_by_category,
-            labels=[f"{label} (${value:.2f})" for label, value in income_by_category.items()],
-            autopct="%1.1f%%",
-        )    
-        ax.set_title(f"收入類別", fontproperties=fontP)
-        for text in texts:
-            text.set_fontproperties(fontP)
-        plt.setp(autotexts, size=10, weight="bold")
-        st.pyplot(fig)
+        chart = charts.pie_chart("收入類別", tuple(income_by_category.items())) # drawn again only when the amounts change
+        st.image(chart, use_column_width=True)
 
     with col2:
+        profiling.stage("totals")
         total_income = income_by_category.sum()
-        selected_month_str = ", ".join(selected_month)
+        selected_month_str = ", ".join(utils.month_label(period) for period in selected_month)
         st.subheader("總收入")
         st.write(f"時限：{selected_month_str}")
 
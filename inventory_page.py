@@ -1,117 +1,108 @@
 import streamlit as st
 import pandas as pd
-import asyncio
-import time
-import io
-import base64
 import docx
 
-import database as db
+import data_access
+import table_view
+import exports
+import editor_diff
+import mutations
+import profiling
 import columns_categories_config as ccconfig
 
-@st.cache_data
-def fetch_all_herbs_cache():
+def load_herbs():
     try:
-        data = db.fetch_all_herbs()
-        return data
+        return data_access.frame("inventory") # in-memory copy, kept in sync with the database
     except Exception as e:
         st.error(f"讀取存貨數據時發生錯誤：{e}")
-        return []
+        return pd.DataFrame(columns=ccconfig.INVENTORY_COLUMN_ORDER)
 
 
 def add_new_herb(herb_id, brand, herb_name, cost_price, selling_price, stock):
-    async def add_new_herb_async(herb_id, brand, herb_name, cost_price, selling_price, stock):
-        try:
-            db.insert_herb(herb_id, brand, herb_name, cost_price, selling_price, stock)
-        except Exception as e:
-            st.error(f"新增存貨數據時發生錯誤：{e}")
-        finally:
-            st.cache_data.clear()
-
-    coro = add_new_herb_async(herb_id, brand, herb_name, cost_price, selling_price, stock)
-    with st.spinner("正在加入存貨數據..."):
-        asyncio.run(coro)
-    st.success(ccconfig.SUCCESS_MSG)
-    time.sleep(1)
-    st.experimental_rerun()
-
-
-def update_inventory(old_df, edited_df):
-    try:
-        different_rows = (old_df != edited_df).any(axis=1)
-        herb_id = old_df[different_rows]['key'].values[0]
-        for col in edited_df.columns:
-            if edited_df[col][different_rows].values[0] != old_df[col][different_rows].values[0]:
-                col_changed = col
-                new_value = edited_df.loc[different_rows, col].values[0]
-                if not isinstance(new_value, str):
-                    new_value = float(new_value)
-                break
-
-        async def update_herb_async(herb_id, col_changed, new_value):
-            try:
-                db.update_herb(herb_id, {f"{col_changed}": new_value})
-            except Exception as e:
-                st.error(f"更新存貨數據時發生錯誤：{e}")
-            finally:
-                st.cache_data.clear()
-
-        coro = update_herb_async(herb_id, col_changed, new_value)
-        with st.spinner("正在更新存貨數據..."):
-            asyncio.run(coro)
-        st.success(ccconfig.SUCCESS_MSG)
-        time.sleep(1)
-        st.experimental_rerun()
-
-    except Exception as e:
-        st.error(f"更新存貨數據時發生錯誤：{e}")
+    new_item = {
+        "key": herb_id,
+        "brand": brand,
+        "herb_name": herb_name,
+        "cost_price": cost_price,
+        "selling_price": selling_price,
+        "inventory": stock,
+    }
+    mutations.put(
+        "inventory", new_item,
+        description=f"新增存貨編號 {herb_id}",
+    )
+
+
+def update_inventory(changes):
+    """`changes` is {herb id: {column: new value}}; each herb is queued as one update"""
+    for herb_id, updates in changes.items():
+        mutations.update(
+            "inventory", herb_id, updates,
+            description=f"更新存貨編號 {herb_id}",
+        )
 
 
 def remove_herb(herb_id):
-    async def remove_herb_async(herb_id):
-        try:
-            db.delete_herb(herb_id)
-        except Exception as e:
-            st.error(f"移除存貨數據時發生錯誤：{e}")
-        finally:
-            st.cache_data.clear()
+    mutations.delete(
+        "inventory", herb_id,
+        description=f"移除存貨編號 {herb_id}",
+    )
+
+
+def add_herb_clicked():
+    state = st.session_state
+    herb_id = state["herb_id"]
+    fields = [herb_id, state["herb_brand"], state["herb_name"], state["herb_cost_price"], state["herb_stock"]]
+    if any(field == "" for field in fields):
+        mutations.notify("warning", ccconfig.WARNING_MSG_FILL_ALL)
+    elif data_access.exists("inventory", herb_id):
+        mutations.notify("warning", "存貨編號已存在，請填寫另一個編號。")
+    else:
+        add_new_herb(herb_id, state["herb_brand"], state["herb_name"], state["herb_cost_price"], state["herb_selling_price"], state["herb_stock"])
+
+
+def remove_herb_clicked():
+    chosen_herb_id = st.session_state["herb_remove_id"]
+    if chosen_herb_id:
+        if data_access.exists("inventory", chosen_herb_id):
+            remove_herb(chosen_herb_id)
+        else:
+            mutations.notify("warning", "此存貨編號不存在。")
+    else:
+        mutations.notify("warning", "請選擇存貨編號。")
 
-    coro = remove_herb_async(herb_id)
-    with st.spinner("正在移除存貨數據..."):
-        asyncio.run(coro)
-    st.success(ccconfig.SUCCESS_MSG)
-    time.sleep(1)
-    st.experimental_rerun()
 
+def create_word_report(excel_dataframes):
+    doc = docx.Document()
+    for brand, data in excel_dataframes.items():
+        num_items = data.shape[0]  # Count number of items for the brand
+        doc.add_heading(f"{brand} ({num_items}項)", level=1)  # Add num_items to the title
+        exports.add_table(doc, data) # Add table with gridlines, all cells centred
+    return doc
 
 
 def inventory():
     BRANDS = ccconfig.HERB_BRANDS # ["Sam Gau", "Hoi Tin", "Others"]
     COLUMN_ORDER = ccconfig.INVENTORY_COLUMN_ORDER # ["key", "brand", "herb_name", "cost_price", "selling_price", "inventory"]
-    inventory_data = fetch_all_herbs_cache()
-    df_inventory = pd.DataFrame(inventory_data, columns=COLUMN_ORDER) # initialize dataframe with the expected column order
-    herb_id_list = df_inventory['key'].tolist() # list of all herb_id
+    profiling.stage("load")
+    mutations.show_status() # messages from the buttons below and from background writes
+    df_inventory = load_herbs() # columns are already in the expected order
 
     # Display input fields for adding new inventory entries
+    profiling.stage("form")
     st.header("新增存貨")
-    herb_id = st.text_input("存貨編號")
-    brand = st.selectbox("品牌", BRANDS)
-    herb_name = st.text_input("存貨名稱")
-    cost_price = st.number_input("來貨價", step=0.1)
-    selling_price = st.number_input("零售價", step=0.1) # Can be 0 or None
-    stock = st.number_input("數量", step=1)
-
-    if st.button("新增存貨"):
-        if any(field == "" for field in [herb_id, brand, herb_name, cost_price, stock]):
-            st.warning(ccconfig.WARNING_MSG_FILL_ALL)
-        elif herb_id in herb_id_list:
-            st.warning("存貨編號已存在，請填寫另一個編號。")
-        else:
-            add_new_herb(herb_id, brand, herb_name, cost_price, selling_price, stock)
+    st.text_input("存貨編號", key="herb_id")
+    st.selectbox("品牌", BRANDS, key="herb_brand")
+    st.text_input("存貨名稱", key="herb_name")
+    st.number_input("來貨價", step=0.1, key="herb_cost_price")
+    st.number_input("零售價", step=0.1, key="herb_selling_price") # Can be 0 or None
+    st.number_input("數量", step=1, key="herb_stock")
+    st.button("新增存貨", on_click=add_herb_clicked) # runs before the page is drawn again
 
 
         
     # Display the current inventory table (using st.data_editor)
+    profiling.stage("editor")
     st.divider()
     st.header("現時存貨")
 
@@ -126,11 +117,9 @@ def inventory():
         df_inventory = df_inventory[
             (df_inventory['brand'].isin(selected_brand))
         ]
-        edited_df_inventory = st.data_editor(
+        page_df = table_view.paginated_editor(
             df_inventory, 
-            use_container_width=True,
-            num_rows="fixed",
-            hide_index=True,
+            key="inventory_editor", # the edited cells are read from st.session_state["inventory_editor"]
             column_config = {
                 "key": st.column_config.Column("存貨編號", disabled=True, help=ccconfig.INFO_MSG_NOT_EDITABLE),
                 "brand": st.column_config.TextColumn("品牌", disabled=True, help=ccconfig.INFO_MSG_NOT_EDITABLE),
@@ -140,29 +129,22 @@ def inventory():
                 "inventory": st.column_config.NumberColumn("數量", min_value=0, step=1),
             },
         )
-        if edited_df_inventory is not None and not edited_df_inventory.equals(df_inventory):
-            update_inventory(df_inventory, edited_df_inventory)
+        # Edits are kept until saved, then written together. The editor starts afresh
+        # once the saved values come back, as its data has changed
+        editor_state = st.session_state.get("inventory_editor", {})
+        changes = editor_diff.diff_edits(page_df, editor_state.get("edited_rows", {})) # {herb id: {column: new value}}
+        if changes:
+            st.caption(f"{sum(len(updates) for updates in changes.values())} 個未儲存的更改")
+            st.button("儲存更改", type="primary", on_click=update_inventory, args=(changes,))
     
     with col2:
         st.subheader("移除存貨：")
-        herb_id_list = df_inventory["key"].tolist()
-        chosen_herb_id = st.text_input("輸入存貨編號移除：")
+        st.text_input("輸入存貨編號移除：", key="herb_remove_id")
         with st.expander("確認移除存貨", expanded=False):
-            delete_button = st.button("確認", type="primary")
-
-        if delete_button:
-            if chosen_herb_id:
-                if chosen_herb_id in herb_id_list:
-                    remove_herb(chosen_herb_id)
-                    st.success(f"已移除存貨編號：{chosen_herb_id}，現在現在刷新頁面...")
-                    time.sleep(1)
-                    st.experimental_rerun()
-                else:
-                    st.warning("此存貨編號不存在。")
-            else:
-                st.warning("請選擇存貨編號。")
+            st.button("確認", type="primary", on_click=remove_herb_clicked)
                 
 
+    profiling.stage("brand tables")
     st.divider()
     for brand in BRANDS:
         brand_data = df_inventory[df_inventory["brand"] == brand]
@@ -170,10 +152,9 @@ def inventory():
         brand_data = brand_data.drop(columns=["brand"])
         num_items = brand_data.shape[0]  # Count number of items for the brand
         st.subheader(f"{brand} ({num_items}項)")
-        st.dataframe(
+        table_view.paginated_dataframe(
             brand_data, 
-            hide_index=True,
-            use_container_width=True,
+            key=f"inventory_table_{brand}",
             column_config={
                 "key": st.column_config.Column("存貨編號", disabled=True),
                 "herb_name": st.column_config.TextColumn("存貨名稱"),
@@ -184,6 +165,7 @@ def inventory():
         )
 
     # Export excel and word files
+    profiling.stage("exports")
     st.divider()
     st.subheader("下載存貨文件")
     arrange_by_mapping = {
@@ -192,45 +174,32 @@ def inventory():
     }
     arrange_by = st.selectbox("排序方式", ["key", "herb_name"], format_func=lambda option: arrange_by_mapping[option])
 
-    # Export Excel button
-    excel_dataframes = {
-        f"{brand}存貨": df_inventory[df_inventory["brand"] == brand][COLUMN_ORDER]
-        .drop(columns=["brand"])
-        .sort_values(by=arrange_by)
-        .reset_index(drop=True)
-        .rename(columns={"key": "存貨編號", "herb_name": "存貨名稱", "cost_price": "來貨價", "selling_price": "零售價", "inventory": "數量"})
-        for brand in BRANDS
-    }
-    excel_buffer = io.BytesIO()
-    with pd.ExcelWriter(excel_buffer, engine="xlsxwriter") as writer:
-        for sheet_name, data in excel_dataframes.items():
-            data.to_excel(writer, sheet_name=sheet_name, index=False)
-    b64_excel = base64.b64encode(excel_buffer.getvalue()).decode()
-    href_excel = f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64_excel}" download="inventory.xlsx" class="button">下載Excel存貨報告</a>'
-    st.markdown(href_excel, unsafe_allow_html=True)
-
-    # Export Word button
-    doc = docx.Document()
-    for brand, data in excel_dataframes.items():
-        num_items = data.shape[0]  # Count number of items for the brand
-        doc.add_heading(f"{brand} ({num_items}項)", level=1)  # Add num_items to the title
-        # Add table with gridlines
-        table = doc.add_table(data.shape[0] + 1, data.shape[1])
-        table.style = "Table Grid"
-        for j, col_name in enumerate(data.columns):
-            table.cell(0, j).text = col_name
-            for i in range(data.shape[0]):
-                table.cell(i + 1, j).text = str(data.iloc[i, j])
-        for row in table.rows:
-            for cell in row.cells:
-                cell.paragraphs[0].alignment = docx.enum.text.WD_ALIGN_PARAGRAPH.CENTER
-                cell.paragraphs[0].paragraph_format.alignment = docx.enum.text.WD_PARAGRAPH_ALIGNMENT.CENTER
-    doc_buffer = io.BytesIO()
-    doc.save(doc_buffer)
-    doc_buffer.seek(0)
-    b64_word = base64.b64encode(doc_buffer.read()).decode()
-    href_word = f'<a href="data:application/vnd.openxmlformats-officedocument.wordprocessingml.document;base64,{b64_word}" download="inventory.docx" class="button">下載Word存貨報告</a>'
-    st.markdown(href_word, unsafe_allow_html=True)
+    def excel_dataframes():
+        return {
+            f"{brand}存貨": df_inventory[df_inventory["brand"] == brand][COLUMN_ORDER]
+            .drop(columns=["brand"])
+            .sort_values(by=arrange_by)
+            .reset_index(drop=True)
+            .rename(columns={"key": "存貨編號", "herb_name": "存貨名稱", "cost_price": "來貨價", "selling_price": "零售價", "inventory": "數量"})
+            for brand in BRANDS
+        }
+    export_signature = (exports.data_signature(df_inventory), tuple(selected_brand), arrange_by)
+
+    # Export Excel button (built only when asked for)
+    exports.download_button(
+        "Excel存貨報告", "inventory.xlsx", exports.XLSX_MIME,
+        build=lambda: exports.build_xlsx(excel_dataframes()),
+        key="inventory_xlsx",
+        signature=export_signature,
+    )
+
+    # Export Word button (built only when asked for)
+    exports.download_button(
+        "Word存貨報告", "inventory.docx", exports.DOCX_MIME,
+        build=lambda: exports.build_docx(create_word_report(excel_dataframes())),
+        key="inventory_docx",
+        signature=export_signature,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,127 @@
+import random
+import sys
+from datetime import date, timedelta
+
+import utils
+import columns_categories_config as ccconfig
+
+# Made-up herbs, incomes and expenses for trying the app (and benchmark.py) with realistic volumes.
+# The same size and seed always give the same rows, so timings taken on different days compare.
+# Usage: python ledger_generator.py SIZE [SEED]    e.g. python ledger_generator.py 100k
+# writes SIZE rows into each of inventory_db, income_db and expense_db of the backend set in .env
+# (set STORAGE_BACKEND=sqlite to keep them off Deta).
+
+SIZES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+WRITE_CHUNK_ROWS = 10_000 # rows generated and written per step, so 1m rows are never all in memory
+START_DATE = date(2022, 1, 1) # incomes and expenses are spread over DAYS days from here
+DAYS = 730
+
+INCOME_WEIGHTS = [50, 35, 5, 10] # how often each of ccconfig.INCOME_CATEGORIES comes up
+EXPENSE_WEIGHTS = [2, 4, 40, 4, 5, 30, 15] # same for ccconfig.EXPENSE_CATEGORIES
+CUSTOMERS = 5000
+
+
+def parse_size(size):
+    """Number of rows for "1k", "100k", "1m" or a plain number"""
+    size = str(size).lower()
+    return SIZES[size] if size in SIZES else int(size)
+
+
+def random_date(rng):
+    return (START_DATE + timedelta(days=rng.randrange(DAYS))).strftime(utils.DATE_FORMAT)
+
+
+def generate_herbs(rows, seed=0):
+    """Yields `rows` herbs shaped like inventory_db items"""
+    rng = random.Random(f"herbs-{seed}")
+    for number in range(1, rows + 1):
+        cost_price = rng.randrange(10, 500)
+        yield {
+            "key": f"h{number:07d}",
+            "brand": rng.choice(ccconfig.HERB_BRANDS),
+            "herb_name": rng.choice(ccconfig.HERB_NAMES),
+            "cost_price": cost_price,
+            "selling_price": cost_price * rng.choice([0, 2, 3]), # 0: not sold on its own
+            "inventory": rng.randrange(0, 100),
+        }
+
+
+def generate_incomes(rows, seed=0):
+    """Yields `rows` incomes shaped like the rows insert_incomes takes"""
+    rng = random.Random(f"incomes-{seed}")
+    for number in range(1, rows + 1):
+        category = rng.choices(ccconfig.INCOME_CATEGORIES, weights=INCOME_WEIGHTS)[0]
+        yield {
+            "key": f"i{number:07d}",
+            "date": random_date(rng),
+            "category": category,
+            "item": rng.choice(ccconfig.HERB_NAMES) if category == "中藥零售" else category,
+            "customer": f"客戶{rng.randrange(CUSTOMERS):04d}",
+            "amount": rng.randrange(50, 2000),
+        }
+
+
+def generate_expenses(rows, seed=0):
+    """Yields `rows` expenses shaped like the rows insert_expenses takes"""
+    rng = random.Random(f"expenses-{seed}")
+    for number in range(1, rows + 1):
+        category = rng.choices(ccconfig.EXPENSE_CATEGORIES, weights=EXPENSE_WEIGHTS)[0]
+        yield {
+            "key": f"e{number:07d}",
+            "date": random_date(rng),
+            "category": category,
+            "item": rng.choice(ccconfig.HERB_NAMES) if category == "訂貨" else category,
+            "amount": rng.randrange(100, 20000),
+        }
+
+
+GENERATORS = {"inventory": generate_herbs, "income": generate_incomes, "expense": generate_expenses}
+
+
+def chunks(rows, size=WRITE_CHUNK_ROWS):
+    """Splits an iterator of rows into lists of up to `size` rows"""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def seed_tables(bases, rows, seed=0, periods_base=None, on_chunk=None):
+    """Writes `rows` generated rows into each of `bases` ({"inventory": base, "income": base, "expense": base}),
+    stamped and with their "period", as the app stores them. The months written are recorded in
+    `periods_base`, if given (see db.mark_period). on_chunk(table, rows written), if given, is called
+    after each chunk. Returns {table: number of rows that failed}"""
+    import database as db # connects to the backend, so only when writing
+
+    failed = {}
+    for table, base in bases.items():
+        written = 0
+        failed[table] = 0
+        periods = set()
+        for chunk in chunks(GENERATORS[table](rows, seed)):
+            if table != "inventory":
+                chunk = [{**row, "period": utils.date_period(row["date"])} for row in chunk]
+                periods.update(row["period"] for row in chunk)
+            stored, failed_batches = db.put_many(base, [db.stamp(row) for row in chunk])
+            written += len(stored)
+            failed[table] += sum(len(items) for items, _ in failed_batches)
+            if on_chunk is not None:
+                on_chunk(table, written)
+        if periods_base is not None:
+            for period in sorted(periods):
+                periods_base.put({"key": f"{table}-{period}", "table": table, "period": period})
+    return failed
+
+
+if __name__ == "__main__":
+    import database as db
+
+    rows = parse_size(sys.argv[1] if len(sys.argv) > 1 else "1k")
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    bases = {"inventory": db.inventory_db, "income": db.income_db, "expense": db.expense_db}
+    failed = seed_tables(bases, rows, seed, db.periods_db, on_chunk=lambda table, written: print(f"{table}: {written}/{rows}"))
+    print(f"Done, rows not written: {failed}")
@@ -0,0 +1,190 @@
+import bisect
+import functools
+import os
+import threading
+import time
+from collections import deque
+
+# Timings of the database.py functions, kept by this process since it started.
+# Every call wrapped with @timed counts its time, the Deta pages it walked (see count_page),
+# the rows it read or wrote, and whether it raised. The admin panel in app.py shows them,
+# and prometheus_text() / write_prometheus() give them in Prometheus' text format, e.g. for
+# a node_exporter textfile collector reading METRICS_PATH.
+
+DEFAULT_METRICS_PATH = "./data/metrics.prom" # unless METRICS_PATH is set
+RECENT_SAMPLES = 1000 # latest timings per function, for the p50/p95/p99 shown in the app
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10] # seconds, for the Prometheus histogram
+QUANTILES = [0.5, 0.95, 0.99]
+
+
+class CallStats:
+    """Counters for one function"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.pages = 0
+        self.rows = 0
+        self.seconds = 0.0
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS) # calls per bucket; the rest took longer than the last one
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def add(self, seconds, pages, rows, failed):
+        self.calls += 1
+        self.errors += failed
+        self.pages += pages
+        self.rows += rows
+        self.seconds += seconds
+        position = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        if position < len(LATENCY_BUCKETS):
+            self.bucket_counts[position] += 1
+        self.recent.append(seconds)
+
+    def quantiles(self):
+        """{0.5: seconds, 0.95: ..., 0.99: ...} over the recent calls"""
+        ordered = sorted(self.recent)
+        if not ordered:
+            return {q: 0.0 for q in QUANTILES}
+        return {q: ordered[min(int(q * len(ordered)), len(ordered) - 1)] for q in QUANTILES}
+
+
+stats = {}  # function name -> CallStats
+stats_lock = threading.Lock()
+active = threading.local()  # the timed calls running in this thread (or on whose behalf it works, see bind), outermost first
+pages_lock = threading.Lock()  # a call's page count may be added to from several threads
+
+
+def count_rows(result):
+    """Rows read or written, judged by what a database.py function returns"""
+    if result is None:
+        return 0
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, tuple): # put_many's (stored, failed), users_snapshot's (version, users)
+        return count_rows(next((part for part in result if isinstance(part, (list, dict))), None))
+    if isinstance(result, dict):
+        if result and all(isinstance(value, list) for value in result.values()):
+            return sum(len(value) for value in result.values())
+        return 1
+    return 0
+
+
+def count_page():
+    """Called for each page of a fetch; counted for every timed call running in this thread"""
+    calls = getattr(active, "calls", [])
+    if calls:
+        with pages_lock:
+            for call in calls:
+                call["pages"] += 1
+
+
+def bind(function):
+    """Wraps `function` for running on a worker thread (e.g. a ThreadPoolExecutor) so that what it
+    does counts towards the timed calls running here, in the thread that hands out the work"""
+    outer_calls = list(getattr(active, "calls", []))
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        saved = getattr(active, "calls", [])
+        active.calls = outer_calls + saved
+        try:
+            return function(*args, **kwargs)
+        finally:
+            active.calls = saved
+
+    return wrapper
+
+
+def timed(function):
+    """Records the time, pages, rows and errors of each call of `function` under its name"""
+    name = function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        calls = active.__dict__.setdefault("calls", [])
+        call = {"pages": 0}
+        calls.append(call)
+        start = time.perf_counter()
+        result, failed = None, 1
+        try:
+            result = function(*args, **kwargs)
+            failed = 0
+            return result
+        finally:
+            seconds = time.perf_counter() - start
+            calls.pop()
+            with stats_lock:
+                stats.setdefault(name, CallStats()).add(seconds, call["pages"], count_rows(result), failed)
+
+    return wrapper
+
+
+def summary():
+    """One dict per function, slowest p95 first, for showing in the app"""
+    with stats_lock:
+        rows = []
+        for name, entry in stats.items():
+            quantiles = entry.quantiles()
+            rows.append({
+                "function": name,
+                "calls": entry.calls,
+                "errors": entry.errors,
+                "p50 (ms)": round(quantiles[0.5] * 1000, 1),
+                "p95 (ms)": round(quantiles[0.95] * 1000, 1),
+                "p99 (ms)": round(quantiles[0.99] * 1000, 1),
+                "pages / call": round(entry.pages / entry.calls, 1),
+                "rows / call": round(entry.rows / entry.calls, 1),
+            })
+    return sorted(rows, key=lambda row: row["p95 (ms)"], reverse=True)
+
+
+def prometheus_text():
+    """All counters in Prometheus' text exposition format"""
+    lines = [
+        "# HELP ledger_db_call_seconds Time taken by database.py functions.",
+        "# TYPE ledger_db_call_seconds histogram",
+    ]
+    with stats_lock:
+        entries = sorted(stats.items())
+        for name, entry in entries:
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, entry.bucket_counts):
+                cumulative += count
+                lines.append(f'ledger_db_call_seconds_bucket{{function="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'ledger_db_call_seconds_bucket{{function="{name}",le="+Inf"}} {entry.calls}')
+            lines.append(f'ledger_db_call_seconds_sum{{function="{name}"}} {entry.seconds:.6f}')
+            lines.append(f'ledger_db_call_seconds_count{{function="{name}"}} {entry.calls}')
+        lines += [
+            "# HELP ledger_db_call_recent_seconds Quantiles of the latest calls' time.",
+            "# TYPE ledger_db_call_recent_seconds gauge",
+        ]
+        for name, entry in entries:
+            for q, seconds in entry.quantiles().items():
+                lines.append(f'ledger_db_call_recent_seconds{{function="{name}",quantile="{q}"}} {seconds:.6f}')
+        for metric, field, help_text in [
+            ("ledger_db_call_errors_total", "errors", "Calls that raised."),
+            ("ledger_db_pages_total", "pages", "Pages fetched from the database."),
+            ("ledger_db_rows_total", "rows", "Rows read or written."),
+        ]:
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+            lines += [f'{metric}{{function="{name}"}} {getattr(entry, field)}' for name, entry in entries]
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path=None):
+    """Writes prometheus_text() to `path` (default METRICS_PATH), replacing the file in one step
+    so a reader never sees half of it. Returns the path"""
+    path = path or os.getenv("METRICS_PATH", DEFAULT_METRICS_PATH)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as f:
+        f.write(prometheus_text())
+    os.replace(temporary_path, path)
+    return path
+
+
+def reset():
+    with stats_lock:
+        stats.clear()
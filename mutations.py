@@ -0,0 +1,106 @@
+import streamlit as st
+
+import database as db
+import data_access
+from write_queue import Write, WriteQueue
+
+# Changes made from the pages are applied to the in-memory copy at once, and reads of a table
+# not in memory lay the queued changes over what the database returns (see data_access.overlay),
+# so the page that follows already shows them either way. The database write is queued for the worker
+# threads of write_queue. If it still fails after its retries, the change is taken back out
+# of the copy and the error is shown on the session's next run.
+#
+# Pages call the functions below from button callbacks (on_click), which Streamlit runs
+# before the script itself, so no extra rerun is needed to show the result.
+
+
+NOT_READ = object() # Write.before of an item whose table is not in memory; execute reads it
+
+
+def execute(write):
+    if write.before is NOT_READ: # read here, on the worker thread, before the first attempt
+        write.before = db.get_item(write.table, write.key)
+    if write.kind == "put":
+        return db.put_item(write.table, write.payload)
+    if write.kind == "update":
+        return db.update_item(write.table, write.key, write.payload)
+    return db.delete_item(write.table, write.key)
+
+
+def apply(write):
+    """Shows the change of `write` in the in-memory copy"""
+    if write.kind == "put":
+        data_access.apply_put(write.table, write.payload)
+    elif write.kind == "update":
+        data_access.apply_update(write.table, write.key, write.payload)
+    else:
+        data_access.apply_delete(write.table, write.key)
+
+
+def restore(write):
+    """Puts the item of `write` back in the in-memory copy as it was before the write"""
+    if write.before is NOT_READ: # reading it failed too: the copy can't be trusted, download it again
+        data_access.reload(write.table)
+    elif write.before is None:
+        data_access.apply_delete(write.table, write.key)
+    else:
+        data_access.apply_put(write.table, write.before)
+
+
+queue = WriteQueue(execute, workers=db.WRITE_WORKERS, reapply=apply)
+data_access.unsaved_writes = queue.unsaved # reads of tables not in memory show the queued changes too
+
+
+def submit(write):
+    """Applies a write to the in-memory copy at once, queues it and remembers it for this
+    session's show_status. The item as it was before is taken from the copy if the table is
+    in memory; otherwise execute reads it, so the script thread never downloads anything"""
+    write.before = data_access.item(write.table, write.key) if data_access.is_loaded(write.table) else NOT_READ
+    write.rollback = lambda: restore(write)
+    if write.confirm is None: # a cold table's cached reads come from the database: read again once it has the change
+        write.confirm = lambda result: data_access.bump(write.table)
+    apply(write)
+    write = queue.submit(write)
+    pending = st.session_state.setdefault("pending_writes", [])
+    if write not in pending: # a write folded into one already listed is reported with it
+        pending.append(write)
+    return write
+
+
+def put(table, item, description):
+    """Adds or replaces `item` in "inventory", "income" or "expense" """
+    return submit(Write(
+        table, item["key"], "put", item, description,
+        confirm=lambda stored: data_access.apply_put(table, stored),
+    ))
+
+
+def update(table, key, updates, description):
+    return submit(Write(table, key, "update", updates, description))
+
+
+def delete(table, key, description):
+    return submit(Write(table, key, "delete", None, description))
+
+
+def notify(kind, message):
+    """Leaves a message ("success", "warning" or "error") from a callback for show_status to show"""
+    st.session_state.setdefault("notices", []).append((kind, message))
+
+
+def show_status():
+    """Shows the callbacks' messages and the outcome of the writes that finished since the last run"""
+    for kind, message in st.session_state.pop("notices", []):
+        getattr(st, kind)(message)
+    pending = []
+    for write in st.session_state.get("pending_writes", []):
+        if not write.done:
+            pending.append(write)
+        elif write.status == "failed":
+            st.error(f"{write.description}失敗，已還原：{write.error}")
+        else:
+            st.success(f"{write.description}：已儲存")
+    st.session_state["pending_writes"] = pending
+    retrying = [write for write in pending if write.status == "retrying"]
+    if pending:
+        st.caption(f"正在儲存 {len(pending)} 項更改..." + (f"（{len(retrying)} 項連線失敗，稍後重試）" if retrying else ""))
@@ -0,0 +1,30 @@
+import importlib
+import sys
+import time
+
+# app.py runs again on every rerun, but this module is imported once per process,
+# so the timings below cover what a fresh Streamlit worker had to load.
+
+import_seconds = {}  # name -> seconds its first import took, in load order
+
+
+def record(name, seconds):
+    """Keeps the first timing of `name` and prints it to the server log"""
+    if name not in import_seconds:
+        import_seconds[name] = seconds
+        print(f"[startup] {name} loaded in {seconds:.2f}s")
+
+
+def load_page(module_name, function_name):
+    """Returns the page function, importing its module (and the libraries it pulls in,
+    e.g. matplotlib and python-docx) the first time that page is shown"""
+    if module_name not in sys.modules:
+        start = time.perf_counter()
+        importlib.import_module(module_name)
+        record(module_name, time.perf_counter() - start)
+    return getattr(sys.modules[module_name], function_name)
+
+
+def import_report():
+    """Lines like "income_page: 0.85s", oldest first, for showing in the app"""
+    return [f"{name}: {seconds:.2f}s" for name, seconds in import_seconds.items()]
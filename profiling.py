@@ -0,0 +1,140 @@
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+# Opt-in timings of one rerun, step by step. app.py calls start_run() when an admin has
+# turned profiling on; until then span() and stage() do nothing but return.
+#   stage("load")            ends the page's previous stage and starts this one
+#   with span("pie chart"):  times a block inside the current stage
+# finish_run() returns the spans for waterfall_lines() to draw.
+# The script thread of a session runs one rerun at a time, so the run is kept per thread.
+
+PROFILES_DIR = "./data/profiles" # where cProfile dumps of single reruns are saved
+WATERFALL_WIDTH = 24 # characters of the bar column in waterfall_lines
+CPROFILE_LINES = 30 # functions listed in the text summary of a dump
+
+current = threading.local()
+cprofile_lock = threading.Lock() # held while a cProfile runs: one profiler per process, whatever the Python version
+
+
+class Span:
+    def __init__(self, name, start, depth):
+        self.name = name
+        self.start = start  # seconds since the run started
+        self.seconds = None
+        self.depth = depth
+
+
+class Run:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+        self.depth = 0
+        self.stage = None  # the stage open at the current depth, closed by the next stage() or the enclosing span's end
+
+    def open(self, name):
+        span = Span(name, time.perf_counter() - self.started, self.depth)
+        self.spans.append(span)
+        self.depth += 1
+        return span
+
+    def close(self, span):
+        span.seconds = time.perf_counter() - self.started - span.start
+        self.depth -= 1
+
+    def close_stage(self):
+        if self.stage is not None:
+            self.close(self.stage)
+            self.stage = None
+
+
+def start_run():
+    current.run = Run()
+
+
+def running():
+    return getattr(current, "run", None) is not None
+
+
+@contextmanager
+def span(name):
+    """Times the block as `name`, nested under whatever span or stage is open"""
+    run = getattr(current, "run", None)
+    if run is None:
+        yield
+        return
+    entry = run.open(name)
+    outer_stage, run.stage = run.stage, None
+    try:
+        yield
+    finally:
+        run.close_stage()
+        run.close(entry)
+        run.stage = outer_stage
+
+
+def stage(name):
+    """Ends the previous stage at this level and starts timing `name`"""
+    run = getattr(current, "run", None)
+    if run is None:
+        return
+    run.close_stage()
+    run.stage = run.open(name)
+
+
+def finish_run():
+    """Ends the run and returns (its spans in the order they started, total seconds); None if no run"""
+    run = getattr(current, "run", None)
+    if run is None:
+        return None
+    current.run = None
+    run.close_stage()
+    total = time.perf_counter() - run.started
+    for entry in run.spans:
+        if entry.seconds is None: # left open by an exception
+            entry.seconds = total - entry.start
+    return run.spans, total
+
+
+def waterfall_lines(spans, total, width=WATERFALL_WIDTH):
+    """Text waterfall, one line per span: name indented by depth, a bar placed at its start, then its time"""
+    name_width = max([len(entry.name) + 2 * entry.depth for entry in spans] + [5])
+    scale = width / total if total else 0
+    lines = [f"{'total':<{name_width}} {'█' * width} {total * 1000:7.1f} ms"]
+    for entry in spans:
+        offset = min(int(entry.start * scale), width - 1)
+        length = max(1, min(round(entry.seconds * scale), width - offset))
+        bar = " " * offset + "█" * length
+        lines.append(f"{'  ' * entry.depth + entry.name:<{name_width}} {bar:<{width}} {entry.seconds * 1000:7.1f} ms")
+    return lines
+
+
+def start_cprofile():
+    """Returns a running cProfile.Profile, or None if another one is already running in this process
+    (e.g. another session is being profiled at the same moment). Hand it to save_cprofile when done"""
+    if not cprofile_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError: # Python 3.12+: a profiler not started here is active
+        cprofile_lock.release()
+        return None
+    return profiler
+
+
+def save_cprofile(profiler, name):
+    """Stops `profiler`, saves its stats to PROFILES_DIR and returns (path, summary text sorted by cumulative time).
+    The .prof file opens with pstats, snakeviz and similar tools"""
+    profiler.disable()
+    cprofile_lock.release()
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    path = os.path.join(PROFILES_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+    profiler.dump_stats(path)
+    text = io.StringIO()
+    pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(CPROFILE_LINES)
+    return path, text.getvalue()
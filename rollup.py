@@ -0,0 +1,39 @@
+import pandas as pd
+
+import utils
+
+ROLLUP_COLUMNS = ["period", "category", "amount", "count"]
+
+
+class MonthlyRollup:
+    """Sum and count of "amount" per (period, category), updated one record at a time.
+    The statistics page reads this instead of the raw rows, so its cost grows with
+    the number of months rather than the number of transactions."""
+
+    def __init__(self):
+        self.cells = {}  # (period, category) -> [amount, count]
+        self.df = None  # frame() result, rebuilt only after a change
+
+    def rebuild(self, items):
+        self.cells = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item, sign=1):
+        cell_key = (utils.date_period(item["date"]), item["category"])
+        cell = self.cells.setdefault(cell_key, [0, 0])
+        cell[0] += sign * (item.get("amount") or 0)
+        cell[1] += sign
+        if cell[1] == 0:
+            del self.cells[cell_key]
+        self.df = None
+
+    def remove(self, item):
+        self.add(item, sign=-1)
+
+    def frame(self):
+        """Returns a DataFrame with columns period, category, amount, count, sorted by period"""
+        if self.df is None:
+            rows = [(period, category, amount, count) for (period, category), (amount, count) in self.cells.items()]
+            self.df = pd.DataFrame(rows, columns=ROLLUP_COLUMNS).sort_values(["period", "category"], ignore_index=True)
+        return self.df.copy()
@@ -1,52 +1,51 @@
 import streamlit as st
 import pandas as pd
 import utils
-import matplotlib.pyplot as plt
-from matplotlib import font_manager
-import io
-import base64
 from docx import Document
-from docx.enum.text import WD_ALIGN_PARAGRAPH
 
-import database as db
+import data_access
+import rollup
+import exports
+import charts
+import profiling
 import columns_categories_config as ccconfig
 
-@st.cache_data
-def fetch_all_incomes_cached():
+def load_monthly_incomes_and_expenses():
     try:
-        data = db.fetch_all_incomes()
-        return data
+        # Monthly roll-ups (one row per month and category) instead of every transaction; both tables are synced at the same time
+        rollups, fetch_seconds = data_access.read_many(data_access.rollup, ["income", "expense"])
+        return rollups["income"], rollups["expense"], fetch_seconds
     except Exception as e:
-        st.error(f"讀取收入數據時發生錯誤：{e}")
-        return []
+        st.error(f"讀取收入及支出數據時發生錯誤：{e}")
+        return pd.DataFrame(columns=rollup.ROLLUP_COLUMNS), pd.DataFrame(columns=rollup.ROLLUP_COLUMNS), 0.0
 
-@st.cache_data
-def fetch_all_expenses_cached():
-    try:
-        data = db.fetch_all_expenses()
-        return data
-    except Exception as e:
-        st.error(f"讀取支出數據時發生錯誤：{e}")
-        return []
+
+def convert_to_category_table(df, categories):
+    if df.empty:
+        return pd.DataFrame(columns=["period", "month"] + categories)  # Return an empty DataFrame with the required columns
+    table_df = df.pivot_table(index='period', columns='category', values='amount', aggfunc='sum', fill_value=0) # sorted by period
+    table_df = table_df.reindex(columns=categories, fill_value=0).reset_index()
+    table_df.columns.name = None
+    table_df.insert(1, 'month', table_df['period'].map(utils.month_label))
+    return table_df
 
 
-def convert_to_monthly_summary(df, month_options):
+def convert_to_monthly_summary(df):
     if df.empty:
-        return pd.DataFrame(columns=["month", "amount"])  # Return an empty DataFrame with the required columns
-    summary_df = df.groupby('month', as_index=False)['amount'].sum()
-    summary_df['month'] = pd.Categorical(summary_df['month'], categories=month_options, ordered=True)
-    summary_df = summary_df.sort_values('month')
-    return summary_df[['month', 'amount']] 
+        return pd.DataFrame(columns=["period", "month", "amount"])  # Return an empty DataFrame with the required columns
+    summary_df = df.groupby('period', as_index=False)['amount'].sum() # sorted by period
+    summary_df.insert(1, 'month', summary_df['period'].map(utils.month_label))
+    return summary_df[['period', 'month', 'amount']]
 
 
 @st.cache_data
 def get_income_expense_by_month(df_income_by_month, df_expense_by_month):
-    df_income_expense_by_month = pd.merge(df_income_by_month, df_expense_by_month, on='month', how='outer')
+    df_income_expense_by_month = pd.merge(df_income_by_month, df_expense_by_month, on=['period', 'month'], how='outer')
     df_income_expense_by_month = df_income_expense_by_month.rename(columns={
         'amount_x': 'Income',
         'amount_y': 'Expense'
-    })
-    months_list = df_income_expense_by_month['month'].tolist()
+    }).sort_values('period', ignore_index=True)
+    months_list = df_income_expense_by_month['period'].tolist()
     return df_income_expense_by_month, months_list
 
 
@@ -54,36 +53,22 @@ def create_word_report(dataframes):
     doc = Document()
     for title, df in dataframes.items():
         doc.add_heading(title, level=1)
-        # Add table with gridlines
-        table = doc.add_table(rows=df.shape[0] + 1, cols=df.shape[1])
-        table.style = "Table Grid"
-        # Set column headers
-        for j, col_name in enumerate(df.columns):
-            cell = table.cell(0, j)
-            cell.text = col_name
-            cell.paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.CENTER
-        # Fill data into the table
-        for i in range(df.shape[0]):
-            for j in range(df.shape[1]):
-                cell = table.cell(i + 1, j)
-                cell.text = str(df.iat[i, j])
-                cell.paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.CENTER
+        exports.add_table(doc, df) # Add table with gridlines, all cells centred
     return doc
     
 
 def statistics():
     st.header("統計")
     
-    income_data = fetch_all_incomes_cached()
-    expense_data = fetch_all_expenses_cached()
+    profiling.stage("load rollups")
+    df_income, df_expense, fetch_seconds = load_monthly_incomes_and_expenses()
+    st.caption(f"讀取數據用時：{fetch_seconds:.2f}秒")
 
+    profiling.stage("category tables")
     col1, col2 = st.columns(2)
     with col1:
         INCOME_CATEGORIES = ccconfig.INCOME_CATEGORIES # ["Consultation", "Herb Sale", "Class", "Others"]
-        INCOME_COLUMN_ORDER = ccconfig.INCOME_COLUMN_ORDER # ["key", "category", "item", "customer", "amount"]
-        df_income = pd.DataFrame(income_data, columns=INCOME_COLUMN_ORDER)
-        df_income['month'] = df_income['date'].apply(utils.format_month) # add a new column "month", by reading the "date" column
-        income_month_options = df_income['month'].unique() # list of months, e.g. ['2023 May' '2023 Jun' '2023 Jul' '2023 Aug']
+        income_month_options = utils.month_options(df_income) # list of periods, e.g. ['2023 May' '2023 Jun' '2023 Jul' '2023 Aug']
         # Display for checking only, will hide it
         # st.dataframe(df_income,
         #                 hide_index=True, 
@@ -96,17 +81,11 @@ def statistics():
         #                 "amount": st.column_config.NumberColumn("Amount", format="$%d"),
         #                 }
         #             )
-    if len(income_data) > 0:
-        df_income_by_category = df_income.pivot_table(index='month', columns='category', values='amount', aggfunc='sum', fill_value=0)
-        df_income_by_category.reset_index(inplace=True)
-        df_income_by_category = df_income_by_category.set_index('month').reindex(income_month_options).reset_index()
-        df_income_by_category = df_income_by_category[['month'] + INCOME_CATEGORIES]
-    else:
-        df_income_by_category = pd.DataFrame(columns=['month'] + INCOME_CATEGORIES)
+    df_income_by_category = convert_to_category_table(df_income, INCOME_CATEGORIES)
 
     
     st.subheader("收入類別")
-    st.dataframe(df_income_by_category, 
+    st.dataframe(df_income_by_category.drop(columns=['period']), 
                     hide_index=True,
                     use_container_width=True,
                     column_config={"month": st.column_config.TextColumn("月份")}
@@ -115,10 +94,7 @@ def statistics():
 
     with col2:
         EXPENSE_CATEGORIES = ccconfig.EXPENSE_CATEGORIES # ["Rent", "Salaries", "Utilities", "Advertising", "Travel", "Others"]
-        EXPENSE_COLUMN_ORDER = ccconfig.EXPENSE_COLUMN_ORDER # ["key", "category", "item", "amount"]
-        df_expense = pd.DataFrame(expense_data, columns=EXPENSE_COLUMN_ORDER)
-        df_expense['month'] = df_expense['date'].apply(utils.format_month) # add a new column "month", by reading the "date" column
-        expense_month_options = df_expense['month'].unique() # list of months, e.g. ['2023 May' '2023 Jun' '2023 Jul' '2023 Aug']
+        expense_month_options = utils.month_options(df_expense) # list of periods, e.g. ['2023 May' '2023 Jun' '2023 Jul' '2023 Aug']
         # Display for checking only, will hide it
         # st.dataframe(df_expense,
         #                 hide_index=True, 
@@ -130,33 +106,26 @@ def statistics():
         #                 "amount": st.column_config.NumberColumn("Amount", format="$%d"),
         #                 }
         #             )
-    if len(expense_data) > 0:
-        df_expense_by_category = df_expense.pivot_table(index='month', columns='category', values='amount', aggfunc='sum', fill_value=0)
-        df_expense_by_category.reset_index(inplace=True)
-        df_expense_by_category = df_expense_by_category.set_index('month').reindex(expense_month_options).reset_index()
-        df_expense_by_category = df_expense_by_category[['month'] + EXPENSE_CATEGORIES]
-    else:
-        df_expense_by_category = pd.DataFrame(columns=['month'] + EXPENSE_CATEGORIES)
+    df_expense_by_category = convert_to_category_table(df_expense, EXPENSE_CATEGORIES)
 
 
     st.subheader("支出類別")
-    st.dataframe(df_expense_by_category,
+    st.dataframe(df_expense_by_category.drop(columns=['period']),
                     hide_index=True,
                     use_container_width=True,
                     column_config={"month": st.column_config.TextColumn("月份")},
                 )
 
  
-    if len(income_data) > 0 and len(expense_data) > 0 and len(income_month_options)==len(expense_month_options):
+    if len(df_income) > 0 and len(df_expense) > 0 and len(income_month_options)==len(expense_month_options):
+        profiling.stage("monthly summary")
         st.subheader("總收入支出總結")
-        df_income_by_month = convert_to_monthly_summary(df_income, income_month_options)
-        df_income_by_month = df_income_by_month.reset_index(drop=True)
-        df_expense_by_month = convert_to_monthly_summary(df_expense, expense_month_options)
-        df_expense_by_month = df_expense_by_month.reset_index(drop=True)
+        df_income_by_month = convert_to_monthly_summary(df_income)
+        df_expense_by_month = convert_to_monthly_summary(df_expense)
 
         df_income_expense_by_month, months_list = get_income_expense_by_month(df_income_by_month, df_expense_by_month)
         df_income_expense_by_month["Net Income"] = df_income_expense_by_month["Income"] - df_income_expense_by_month["Expense"]
-        st.dataframe(df_income_expense_by_month,
+        st.dataframe(df_income_expense_by_month.drop(columns=['period']),
                         hide_index=True,
                         use_container_width=True,
                         column_config={
@@ -169,82 +138,65 @@ def statistics():
         
 
 
+        profiling.stage("month slider")
         st.divider()
         st.subheader("收入支出趨勢")
         start_month, end_month = st.select_slider(
             "選擇時限：",
             options=months_list,
-            value=(months_list[0], months_list[-1]) 
+            value=(months_list[0], months_list[-1]),
+            format_func=utils.month_label,
         )
 
-        # Filter Line chart of "Income by category" by selected months
-        df_income_by_category['month'] = pd.to_datetime(df_income_by_category['month'], format='%Y %b')
+        # Filter Line chart of "Income by category" by selected months (periods are plain integers, so no date parsing here)
         df_income_by_category = df_income_by_category[
-            (df_income_by_category['month'] >= pd.to_datetime(start_month, format='%Y %b')) & 
-            (df_income_by_category['month'] <= pd.to_datetime(end_month, format='%Y %b'))
-        ]
-        df_income_by_category['month'] = df_income_by_category['month'].dt.strftime('%Y %b')
+            df_income_by_category['period'].between(start_month, end_month)
+        ].drop(columns=['period'])
 
         # Filter # Line chart of "Expense by category" by selected months
-        df_expense_by_category['month'] = pd.to_datetime(df_expense_by_category['month'], format='%Y %b')
         df_expense_by_category = df_expense_by_category[
-            (df_expense_by_category['month'] >= pd.to_datetime(start_month, format='%Y %b')) & 
-            (df_expense_by_category['month'] <= pd.to_datetime(end_month, format='%Y %b'))
-        ]
-        df_expense_by_category['month'] = df_expense_by_category['month'].dt.strftime('%Y %b')
+            df_expense_by_category['period'].between(start_month, end_month)
+        ].drop(columns=['period'])
 
         # Filter Line chart of "Total Income, Expense and Net Income" by selected months
         df_income_expense_by_month = df_income_expense_by_month[
-            (df_income_expense_by_month['month'] >= start_month) & (df_income_expense_by_month['month'] <= end_month)
-        ]
-
-        # Set Chinese font
-        fontP = font_manager.FontProperties(fname="./fonts/SimHei.ttf")
-        fontP.set_family('SimHei') 
-        fontP.set_size(14)
-
-        # Display Line chart of "Income by category"
-        plt.figure(figsize=(10, 4))
-        plt.title('收入類別', fontproperties=fontP)
-        for category in INCOME_CATEGORIES:
-            plt.plot(df_income_by_category['month'], df_income_by_category[category], marker='^', label=category)
-        plt.xlabel('月份', fontproperties=fontP)
-        plt.ylabel('金額', fontproperties=fontP)
-        plt.legend(loc=0, prop=fontP)
-        plt.grid(True)
-        st.pyplot(plt)
-
-        # Display Line chart of "Expense by category"
-        plt.figure(figsize=(10, 4))
-        plt.title('支出類別', fontproperties=fontP)
-        for category in EXPENSE_CATEGORIES:
-            plt.plot(df_expense_by_category['month'], df_expense_by_category[category], marker='v', label=category)
-        plt.xlabel('月份', fontproperties=fontP)
-        plt.ylabel('金額', fontproperties=fontP)
-        plt.legend(loc=2, prop=fontP) # '2' means 'upper left'
-        plt.grid(True)
-        st.pyplot(plt)
-
-        # Display Line chart of "Total Income, Expense and Net Income"
-        plt.figure(figsize=(10, 4))
-        plt.title('總收入、總支出和淨收入', fontproperties=fontP)
-        plt.plot(df_income_expense_by_month['month'], df_income_expense_by_month['Income'], marker='^', label='總收入')
-        plt.plot(df_income_expense_by_month['month'], df_income_expense_by_month['Expense'], marker='v', label='總支出')
-        plt.plot(df_income_expense_by_month['month'], df_income_expense_by_month['Net Income'], marker='o', label='淨收入')
-        plt.xlabel('月份', fontproperties=fontP)
-        plt.ylabel('金額', fontproperties=fontP)
-        plt.legend(loc=0, prop=fontP)
-        plt.grid(True)
-        st.pyplot(plt)
+            df_income_expense_by_month['period'].between(start_month, end_month)
+        ].drop(columns=['period'])
+
+        # Line charts, drawn again only when the data or the selected months change
+        profiling.stage("income chart")
+        income_months = tuple(df_income_by_category['month'])
+        st.image(charts.line_chart(
+            '收入類別', income_months,
+            tuple((category, '^', tuple(df_income_by_category[category].tolist())) for category in INCOME_CATEGORIES),
+        ), use_column_width=True)
+
+        profiling.stage("expense chart")
+        expense_months = tuple(df_expense_by_category['month'])
+        st.image(charts.line_chart(
+            '支出類別', expense_months,
+            tuple((category, 'v', tuple(df_expense_by_category[category].tolist())) for category in EXPENSE_CATEGORIES),
+            legend_loc=2, # '2' means 'upper left'
+        ), use_column_width=True)
+
+        profiling.stage("summary chart")
+        summary_months = tuple(df_income_expense_by_month['month'])
+        st.image(charts.line_chart(
+            '總收入、總支出和淨收入', summary_months,
+            (
+                ('總收入', '^', tuple(df_income_expense_by_month['Income'].tolist())),
+                ('總支出', 'v', tuple(df_income_expense_by_month['Expense'].tolist())),
+                ('淨收入', 'o', tuple(df_income_expense_by_month['Net Income'].tolist())),
+            ),
+        ), use_column_width=True)
 
 
         # Export excel and word files
+        profiling.stage("exports")
         st.divider()
         st.subheader("下載統計文件")
 
 
-        # Export excel file
-        excel_buffer = io.BytesIO()
         # Modify names of columns
         df1_2_new_column_names = {'month': '月份'}
         df_income_by_category.rename(columns=df1_2_new_column_names, inplace=True)
@@ -253,30 +205,30 @@ def statistics():
         df3_new_column_names = {'month': '月份', 'Income': '總收入', 'Expense': '總支出', 'Net Income': '淨收入'}
         df_income_expense_by_month.rename(columns=df3_new_column_names, inplace=True)
 
-        with pd.ExcelWriter(excel_buffer, engine="xlsxwriter") as writer:
-            df_income_by_category.to_excel(writer, sheet_name="收入類別", index=False)
-            df_expense_by_category.to_excel(writer, sheet_name="支出類別", index=False)
-            df_income_expense_by_month.to_excel(writer, sheet_name="總收入支出總結", index=False)
-
-        b64 = base64.b64encode(excel_buffer.getvalue()).decode()
-        href = f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="statistics.xlsx" class="button">下載Excel統計報告</a>'
-        st.markdown(href, unsafe_allow_html=True)
-
-        # Export word file
         dataframes = {
             "收入類別": df_income_by_category,
             "支出類別": df_expense_by_category,
             "總收入支出總結": df_income_expense_by_month
         }
-        doc = create_word_report(dataframes)
-        doc_buffer = io.BytesIO()
-        doc.save(doc_buffer)
-        doc_buffer.seek(0)
-        b64 = base64.b64encode(doc_buffer.read()).decode()
-        href = f'<a href="data:application/vnd.openxmlformats-officedocument.wordprocessingml.document;base64,{b64}" download="statistics.docx" class="button">下載Word統計報告</a>'
-        st.markdown(href, unsafe_allow_html=True)
-
-    elif len(income_data) > 0 and len(expense_data) > 0 and len(income_month_options)!=len(expense_month_options):
+        export_signature = exports.data_signature(*dataframes.values())
+
+        # Export excel file (built only when asked for)
+        exports.download_button(
+            "Excel統計報告", "statistics.xlsx", exports.XLSX_MIME,
+            build=lambda: exports.build_xlsx(dataframes),
+            key="statistics_xlsx",
+            signature=export_signature,
+        )
+
+        # Export word file (built only when asked for)
+        exports.download_button(
+            "Word統計報告", "statistics.docx", exports.DOCX_MIME,
+            build=lambda: exports.build_docx(create_word_report(dataframes)),
+            key="statistics_docx",
+            signature=export_signature,
+        )
+
+    elif len(df_income) > 0 and len(df_expense) > 0 and len(income_month_options)!=len(expense_month_options):
         st.subheader("總收入支出總結")
         st.warning("請注意：您的收入和支出數據月份並不一致。 如果想查看總收入、總支出及相關圖表，請先引入相關月份的數據。")
 
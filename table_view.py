@@ -0,0 +1,71 @@
+import math
+
+import streamlit as st
+
+import columns_categories_config as ccconfig
+
+
+def page_controls(df, key, column_config, sort_keys=None, page_size=ccconfig.TABLE_PAGE_SIZE):
+    """Shows the sort and page widgets for `df` and returns (the rows of the chosen page, page number, pages).
+    Sorting and paging happen here on the server, so only the rows of the visible page
+    are sent to the browser however many rows the filters let through.
+    `key` must be unique on the page; it prefixes the keys of the sort and page widgets.
+    `sort_keys` maps a shown column to the column to sort it by, e.g. {"date": "date_value"}."""
+    sort_keys = sort_keys or {}
+    columns = [column for column in column_config if column in df.columns]
+    labels = {column: column_config[column].get("label") or column for column in columns}
+
+    col1, col2, col3 = st.columns([2, 1, 1])
+    with col1:
+        sort_by = st.selectbox(
+            "排序方式",
+            options=[None] + columns,
+            format_func=lambda column: "不排序" if column is None else labels[column],
+            key=f"{key}_sort_by",
+        )
+    with col2:
+        descending = st.checkbox("由大至小", key=f"{key}_descending")
+    with col3:
+        num_pages = max(1, math.ceil(len(df) / page_size))
+        page_key = f"{key}_page"
+        if st.session_state.get(page_key, 1) > num_pages: # the filters left fewer pages than before
+            st.session_state[page_key] = num_pages
+        page = st.number_input("頁數", min_value=1, max_value=num_pages, step=1, key=page_key)
+
+    if sort_by is not None:
+        # Sort positions only; the rows themselves are copied for the visible page alone.
+        # Empty cells (None/NaN in optional text columns) go last either way
+        column = df[sort_keys.get(sort_by, sort_by)].reset_index(drop=True)
+        order = column.sort_values(ascending=not descending, kind="stable", na_position="last").index.to_numpy()
+        page_df = df.iloc[order[(page - 1) * page_size:page * page_size]]
+    else:
+        page_df = df.iloc[(page - 1) * page_size:page * page_size]
+    return page_df, page, num_pages
+
+
+def paginated_dataframe(df, key, column_config, sort_keys=None, page_size=ccconfig.TABLE_PAGE_SIZE):
+    """Shows the columns of `df` listed in `column_config`, one page at a time, with st.dataframe.
+    See page_controls for `key` and `sort_keys`."""
+    page_df, page, num_pages = page_controls(df, key, column_config, sort_keys, page_size)
+    columns = [column for column in column_config if column in df.columns]
+    st.dataframe(page_df, hide_index=True, use_container_width=True, column_order=columns, column_config=column_config)
+    st.caption(f"第 {page} / {num_pages} 頁，共 {len(df)} 項")
+
+
+def paginated_editor(df, key, column_config, sort_keys=None, page_size=ccconfig.TABLE_PAGE_SIZE):
+    """Like paginated_dataframe, with st.data_editor (fixed rows) instead, keyed `key`. Returns the
+    rows of the page shown, which the positions in the editor's "edited_rows" refer to.
+    The editor starts afresh whenever the rows it is given change, so edits not saved
+    are dropped on moving to another page or sort order."""
+    page_df, page, num_pages = page_controls(df, f"{key}_view", column_config, sort_keys, page_size)
+    st.data_editor(
+        page_df,
+        key=key,
+        use_container_width=True,
+        num_rows="fixed",
+        hide_index=True,
+        column_order=[column for column in column_config if column in df.columns],
+        column_config=column_config,
+    )
+    st.caption(f"第 {page} / {num_pages} 頁，共 {len(df)} 項")
+    return page_df
@@ -0,0 +1,95 @@
+import threading
+
+import pytest
+
+import backends
+import deta_standin
+
+# backends.DetaBackend against deta_standin.py, a local stand-in for the Deta Base HTTP API.
+# Run from the repository root: python -m pytest
+
+
+@pytest.fixture
+def standin(tmp_path):
+    server = deta_standin.make_server(0, tmp_path / "standin.db")
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def table(standin):
+    backend = backends.DetaBackend("test_key", base_url=f"http://127.0.0.1:{standin.server_port}/v1", pool_size=2)
+    return backend.table("income_db")
+
+
+def test_put_and_get(table):
+    stored = table.put({"key": "a", "date": "05-Mar-23", "amount": 10})
+    assert stored["key"] == "a"
+    assert table.get("a") == {"key": "a", "date": "05-Mar-23", "amount": 10}
+    assert table.get("missing") is None
+
+
+def test_put_with_key_argument(table):
+    table.put({"amount": 5}, key="b")
+    assert table.get("b")["amount"] == 5
+
+
+def test_put_many(table):
+    response = table.put_many([{"key": f"k{i}", "amount": i} for i in range(3)])
+    assert len(response["processed"]["items"]) == 3
+    assert table.get("k2")["amount"] == 2
+
+
+def test_update(table):
+    table.put({"key": "a", "amount": 10, "category": "診症"})
+    assert table.update({"amount": 20}, "a") is None
+    assert table.get("a") == {"key": "a", "amount": 20, "category": "診症"}
+    with pytest.raises(Exception, match="not found"):
+        table.update({"amount": 1}, "missing")
+
+
+def test_delete(table):
+    table.put({"key": "a", "amount": 10})
+    assert table.delete("a") is None
+    assert table.get("a") is None
+    assert table.delete("missing") is None
+
+
+def test_fetch_query_and_paging(table):
+    table.put_many([{"key": f"k{i}", "period": 24280 + i % 2, "category": "診症"} for i in range(5)])
+    page = table.fetch({"period": 24280}, limit=2)
+    assert [item["key"] for item in page.items] == ["k0", "k2"]
+    assert page.last == "k2"
+    page = table.fetch({"period": 24280}, limit=2, last=page.last)
+    assert [item["key"] for item in page.items] == ["k4"]
+    assert page.last is None
+    either = table.fetch([{"key": "k1"}, {"key": "k3"}])
+    assert [item["key"] for item in either.items] == ["k1", "k3"]
+
+
+def test_keys_are_quoted(table):
+    table.put({"key": "a/b c", "amount": 1})
+    assert table.get("a/b c")["amount"] == 1
+
+
+def test_read_retried_after_dropped_connection(standin, table):
+    table.put({"key": "a", "amount": 10})
+    handle_request = deta_standin.Handler.handle_request
+    dropped = []
+
+    def drop_first(self, method):
+        if not dropped: # like a kept-alive connection the server has closed: no answer at all
+            dropped.append(method)
+            self.close_connection = True
+            return None
+        return handle_request(self, method)
+
+    deta_standin.Handler.handle_request = drop_first
+    try:
+        assert table.get("a")["amount"] == 10
+    finally:
+        deta_standin.Handler.handle_request = handle_request
+    assert dropped == ["GET"]
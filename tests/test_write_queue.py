@@ -0,0 +1,180 @@
+import threading
+import time
+
+import pytest
+
+import write_queue
+from write_queue import Write, WriteQueue
+
+
+@pytest.fixture(autouse=True)
+def quick_retries(monkeypatch):
+    monkeypatch.setattr(write_queue, "WRITE_ATTEMPTS", 3)
+    monkeypatch.setattr(write_queue, "WRITE_BACKOFF_SECONDS", 0.01)
+
+
+class Database:
+    """execute() for a WriteQueue: records what it is sent and fails the first `failures` calls.
+    While `gate` is cleared, calls wait for it, so writes can be queued behind a running one"""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.sent = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.started = threading.Event()
+
+    def execute(self, write):
+        self.started.set()
+        self.gate.wait(timeout=5)
+        self.sent.append((write.kind, write.key, write.payload))
+        if len(self.sent) <= self.failures:
+            raise ConnectionError(f"attempt {len(self.sent)} failed")
+        return write.payload
+
+
+def wait_done(*writes):
+    deadline = time.time() + 5
+    while not all(write.done for write in writes):
+        assert time.time() < deadline, [write.status for write in writes]
+        time.sleep(0.005)
+
+
+def hold_first(database, queue, write):
+    """Submits `write` and returns once a worker is sending it and waiting on the gate"""
+    database.gate.clear()
+    queue.submit(write)
+    assert database.started.wait(timeout=5)
+
+
+def test_second_and_third_write_fold_into_one_behind_a_running_write():
+    database = Database()
+    queue = WriteQueue(database.execute, workers=2)
+    confirmed = []
+    first = Write("inventory", "h1", "update", {"inventory": 1}, confirm=confirmed.append)
+    hold_first(database, queue, first)
+
+    second = Write("inventory", "h1", "update", {"inventory": 2}, confirm=confirmed.append)
+    third = Write("inventory", "h1", "update", {"selling_price": 30}, confirm=confirmed.append)
+    assert queue.submit(second) is second # the running write is not merged into
+    assert queue.submit(third) is second
+    assert queue.unsaved("inventory") == [
+        ("update", "h1", {"inventory": 1}),
+        ("update", "h1", {"inventory": 2, "selling_price": 30}),
+    ]
+    database.gate.set()
+    wait_done(first, second, third)
+
+    assert database.sent == [
+        ("update", "h1", {"inventory": 1}),
+        ("update", "h1", {"inventory": 2, "selling_price": 30}),
+    ]
+    assert second.merged == 1 and second.followers == [third]
+    assert [first.status, second.status, third.status] == ["saved", "saved", "saved"]
+    assert confirmed == [{"inventory": 2, "selling_price": 30}] # the first write's confirm is skipped, a newer one was waiting
+    assert queue.pending() == 0
+
+
+def test_put_then_delete_becomes_a_delete():
+    write = Write("income", "i1", "put", {"key": "i1", "amount": 10})
+    write.merge(Write("income", "i1", "update", {"amount": 20}))
+    assert (write.kind, write.payload) == ("put", {"key": "i1", "amount": 20})
+    write.merge(Write("income", "i1", "delete"))
+    assert (write.kind, write.payload, write.merged) == ("delete", None, 2)
+    write.merge(Write("income", "i1", "update", {"amount": 30}))
+    assert (write.kind, write.payload) == ("delete", None)
+
+
+def test_write_failing_every_attempt_is_rolled_back_once():
+    database = Database(failures=10)
+    queue = WriteQueue(database.execute, workers=1)
+    rolled_back, confirmed = [], []
+    write = Write("income", "i1", "put", {"key": "i1"}, confirm=confirmed.append, rollback=lambda: rolled_back.append("i1"))
+    queue.submit(write)
+    wait_done(write)
+
+    assert write.status == "failed"
+    assert write.attempts == 3
+    assert len(database.sent) == 3
+    assert str(write.error) == "attempt 3 failed"
+    assert rolled_back == ["i1"] and confirmed == []
+    assert queue.unsaved("income") == []
+
+
+def test_retry_carries_the_newer_write_with_it():
+    database = Database(failures=1)
+    queue = WriteQueue(database.execute, workers=1)
+    first = Write("inventory", "h1", "update", {"inventory": 1})
+    hold_first(database, queue, first)
+    newer = Write("inventory", "h1", "update", {"inventory": 2})
+    queue.submit(newer)
+    database.gate.set()
+    wait_done(first, newer)
+
+    assert database.sent == [
+        ("update", "h1", {"inventory": 1}),
+        ("update", "h1", {"inventory": 2}), # one retry sending both, in order
+    ]
+    assert first.attempts == 2 and first.followers == [newer]
+    assert first.status == newer.status == "saved"
+
+
+def test_failure_while_a_newer_write_waits_rolls_back_under_it(monkeypatch):
+    monkeypatch.setattr(write_queue, "WRITE_ATTEMPTS", 1)
+    database = Database(failures=2)
+    events = []
+    queue = WriteQueue(database.execute, workers=1, reapply=lambda write: events.append(("reapply", write.payload)))
+    first = Write(
+        "inventory", "h1", "update", {"inventory": 1},
+        rollback=lambda: events.append(("rollback to", {"inventory": 0})),
+        before={"key": "h1", "inventory": 0},
+    )
+    hold_first(database, queue, first)
+    newer = Write(
+        "inventory", "h1", "update", {"inventory": 2},
+        rollback=lambda: events.append(("newer's own rollback", None)),
+        before={"key": "h1", "inventory": 1},
+    )
+    queue.submit(newer)
+    database.gate.set()
+    wait_done(first, newer)
+
+    assert first.status == newer.status == "failed"
+    assert newer.before == {"key": "h1", "inventory": 0} # handed over by the first write
+    assert events == [
+        ("rollback to", {"inventory": 0}), # the first write is undone...
+        ("reapply", {"inventory": 2}), # ...the newer change shown again on top...
+        ("rollback to", {"inventory": 0}), # ...and when it fails too, the item is as before both
+    ]
+
+
+def test_failure_with_newer_write_saved_keeps_newer_change(monkeypatch):
+    monkeypatch.setattr(write_queue, "WRITE_ATTEMPTS", 1)
+    database = Database(failures=1)
+    events = []
+    queue = WriteQueue(database.execute, workers=1, reapply=lambda write: events.append(("reapply", write.payload)))
+    first = Write("inventory", "h1", "update", {"inventory": 1}, rollback=lambda: events.append(("rollback", None)))
+    hold_first(database, queue, first)
+    newer = Write("inventory", "h1", "update", {"inventory": 2}, confirm=lambda result: events.append(("confirm", result)))
+    queue.submit(newer)
+    database.gate.set()
+    wait_done(first, newer)
+
+    assert (first.status, newer.status) == ("failed", "saved")
+    assert events == [("rollback", None), ("reapply", {"inventory": 2}), ("confirm", {"inventory": 2})]
+
+
+def test_writes_to_different_items_run_side_by_side():
+    database = Database()
+    queue = WriteQueue(database.execute, workers=2)
+    first = Write("inventory", "h1", "update", {"inventory": 1})
+    hold_first(database, queue, first)
+    other = Write("inventory", "h2", "update", {"inventory": 2})
+    queue.submit(other)
+    deadline = time.time() + 5
+    while other.status != "running": # picked up by the second worker while the first is held
+        assert time.time() < deadline
+        time.sleep(0.005)
+    database.gate.set()
+    wait_done(first, other)
+    assert {key for _, key, _ in database.sent} == {"h1", "h2"}
@@ -1,5 +1,39 @@
-from datetime import datetime
+from datetime import date, datetime
+from functools import lru_cache
 
-def format_month(date_str):
-    date_obj = datetime.strptime(date_str, "%d-%b-%y")
-    return date_obj.strftime("%Y %b")
\ No newline at end of file
+DATE_FORMAT = "%d-%b-%y" # how dates are stored, e.g. "28-Aug-23"
+MONTH_COLUMNS = ["date_value", "period", "month"] # columns added by add_month_columns
+
+
+@lru_cache(maxsize=None)
+def month_label(period):
+    """Turns a period key (year * 12 + month - 1) into a label like "2023 Aug" """
+    year, month_index = divmod(int(period), 12)
+    return date(year, month_index + 1, 1).strftime("%Y %b")
+
+
+@lru_cache(maxsize=4096)
+def date_period(date_str):
+    """Period key of a single stored date, e.g. "28-Aug-23" -> 2023 * 12 + 7"""
+    date_obj = datetime.strptime(date_str, DATE_FORMAT)
+    return date_obj.year * 12 + date_obj.month - 1
+
+
+def add_month_columns(df):
+    """Parses the "date" column once for the whole frame and adds:
+    - "date_value": the date as datetime64
+    - "period": an integer month key that sorts and compares correctly (year * 12 + month - 1)
+    - "month": the month label, e.g. "2023 Aug"
+    """
+    import pandas as pd # here, not at the top: database.py imports this module, and pandas is slow to load
+
+    date_values = pd.to_datetime(df["date"], format=DATE_FORMAT)
+    df["date_value"] = date_values
+    df["period"] = (date_values.dt.year * 12 + date_values.dt.month - 1).astype("int64")
+    df["month"] = df["period"].map({period: month_label(period) for period in df["period"].unique()})
+    return df
+
+
+def month_options(df):
+    """Returns the periods present in a frame, oldest first"""
+    return sorted(df["period"].unique().tolist())
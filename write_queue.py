@@ -0,0 +1,171 @@
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+# Writes wait here until a worker thread sends them to the database, so the script thread
+# never waits on the network. A write that fails is tried again later (WRITE_ATTEMPTS in
+# all, waiting WRITE_BACKOFF_SECONDS, then twice as long each time). While a write for a
+# key is still waiting, further writes for the same key are folded into it, so e.g. ten
+# quick edits of one herb's stock are sent as one update.
+# Writes still waiting when the process stops are lost, like any write-behind cache.
+
+WRITE_ATTEMPTS = int(os.getenv("WRITE_ATTEMPTS", "4"))
+WRITE_BACKOFF_SECONDS = float(os.getenv("WRITE_BACKOFF_SECONDS", "0.5"))
+
+
+class Write:
+    """One change to one item: kind "put" (payload is the item), "update" (payload is
+    {field: value}) or "delete" (no payload). Its status is "queued", "running", "retrying",
+    "saved" or "failed"."""
+
+    def __init__(self, table, key, kind, payload=None, description="", confirm=None, rollback=None, before=None):
+        self.table = table
+        self.key = key
+        self.kind = kind
+        self.payload = payload
+        self.description = description
+        self.confirm = confirm  # confirm(result) after the write succeeds
+        self.rollback = rollback  # rollback() after the last attempt fails
+        self.before = before  # the item as it was before this write, for rollback (None: it did not exist)
+        self.status = "queued"
+        self.attempts = 0
+        self.merged = 0  # later writes folded into this one
+        self.error = None
+        self.result = None
+        self.queued_at = time.time()
+        self.finished_at = None
+        self.not_before = 0  # time.time() before which a retry is not sent
+        self.followers = []  # writes folded into this one, which share its outcome
+
+    @property
+    def target(self):
+        return (self.table, self.key)
+
+    @property
+    def done(self):
+        return self.status in ("saved", "failed")
+
+    def merge(self, newer):
+        """Folds a later write for the same item into this one. The rollback of this (the earliest)
+        write is kept, as it restores the item as it was before any of them"""
+        if newer.kind == "update" and self.kind in ("put", "update"):
+            self.payload = {**self.payload, **newer.payload}
+        elif newer.kind == "update": # an update after a delete: the item is gone either way
+            pass
+        else:
+            self.kind = newer.kind
+            self.payload = newer.payload
+            self.confirm = newer.confirm
+        self.merged += 1 + newer.merged
+        self.followers.append(newer)
+        self.followers.extend(newer.followers)
+
+    def set_status(self, status, result=None, error=None):
+        """Sets the status of this write and of the writes folded into it"""
+        for write in [self] + self.followers:
+            write.status = status
+            write.result = result
+            write.error = error
+            if write.done:
+                write.finished_at = time.time()
+
+
+class WriteQueue:
+    """Sends Writes with execute(write) on `workers` threads, one write per item at a time,
+    in the order they were submitted. reapply(write), if given, shows a write's change again
+    after an older write to the same item failed and was rolled back"""
+
+    def __init__(self, execute, workers, reapply=None):
+        self.execute = execute
+        self.reapply = reapply
+        self.waiting = OrderedDict()  # (table, key) -> Write not sent yet, or waiting to be retried
+        self.running = {}  # (table, key) -> Write being sent
+        self.condition = threading.Condition()
+        self.threads = [threading.Thread(target=self.work, name=f"write-{i}", daemon=True) for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, write):
+        """Queues a write and returns the Write to follow: `write` itself, or the waiting
+        write for the same item it was folded into"""
+        with self.condition:
+            queued = self.waiting.get(write.target)
+            if queued is not None:
+                queued.merge(write)
+                return queued
+            self.waiting[write.target] = write
+            self.condition.notify()
+            return write
+
+    def pending(self):
+        """Number of writes not finished yet"""
+        with self.condition:
+            return len(self.waiting) + len(self.running)
+
+    def unsaved(self, table):
+        """(kind, key, payload) of the writes to `table` not in the database yet, oldest first"""
+        with self.condition:
+            writes = [write for target, write in self.running.items() if target[0] == table]
+            writes += [write for target, write in self.waiting.items() if target[0] == table]
+            return [(write.kind, write.key, write.payload) for write in writes]
+
+    def next_ready(self, now):
+        for target, write in self.waiting.items():
+            if target not in self.running and write.not_before <= now:
+                return write
+        return None
+
+    def seconds_to_next_retry(self, now):
+        delays = [write.not_before - now for target, write in self.waiting.items() if target not in self.running]
+        return max(min(delays), 0.01) if delays else None
+
+    def work(self):
+        while True:
+            with self.condition:
+                write = self.next_ready(time.time())
+                while write is None:
+                    self.condition.wait(timeout=self.seconds_to_next_retry(time.time()))
+                    write = self.next_ready(time.time())
+                del self.waiting[write.target]
+                self.running[write.target] = write
+                write.set_status("running")
+                write.attempts += 1
+
+            try:
+                result, error = self.execute(write), None
+            except Exception as e:
+                result, error = None, e
+
+            callback = None
+            with self.condition:
+                del self.running[write.target]
+                newer = self.waiting.get(write.target)
+                if error is None:
+                    write.set_status("saved", result=result)
+                    if write.confirm is not None and newer is None: # otherwise the copy already shows the newer change
+                        callback = lambda: write.confirm(result)
+                elif write.attempts < WRITE_ATTEMPTS:
+                    write.set_status("retrying", error=error)
+                    write.not_before = time.time() + WRITE_BACKOFF_SECONDS * 2 ** (write.attempts - 1) * random.uniform(0.8, 1.2)
+                    if newer is not None: # keep the order of the changes: the retry carries the newer one too
+                        del self.waiting[write.target]
+                        write.merge(newer)
+                    self.waiting[write.target] = write
+                elif newer is not None:
+                    # A newer write to the item is still waiting: undo this one under it, and let the
+                    # newer one roll back to the item as it was before both, should it fail as well.
+                    # Done with the lock held, so the newer write cannot finish in between
+                    write.set_status("failed", error=error)
+                    newer.rollback, newer.before = write.rollback, write.before
+                    if write.rollback is not None:
+                        write.rollback()
+                    if self.reapply is not None:
+                        self.reapply(newer)
+                else:
+                    write.set_status("failed", error=error)
+                    callback = write.rollback
+                self.condition.notify_all()
+            if callback is not None:
+                callback()